@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+benchmark.py: generates a synthetic nagios configuration and measures the
+api in-process through the flask test client. Results are written as JSON,
+so they can be compared between versions.
+
+usage: contrib/benchmark.py --hosts 1000 --services 10 --output result.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import base64
+import argparse
+import tempfile
+import platform
+
+from timeit import default_timer as timer
+
+def generate(directory, hosts=1000, services=10, depth=3, groups=10):
+    """
+    Write a synthetic configuration to directory: a chain of "depth" host
+    and service templates, "groups" hostgroups and one file per host with
+    "services" services. Returns the path of the generated nagios.cfg
+    """
+    objects = os.path.join(directory, 'objects')
+    for subdirectory in ('hosts', 'api'):
+        if not os.path.isdir(os.path.join(objects, subdirectory)):
+            os.makedirs(os.path.join(objects, subdirectory))
+
+    def define(fh, object_type, attributes):
+        fh.write("define %s {\n" % (object_type, ))
+        for key, value in attributes:
+            fh.write("\t%-30s%s\n" % (key, value))
+        fh.write("}\n\n")
+
+    with open(os.path.join(objects, 'templates.cfg'), 'w') as fh:
+        define(fh, 'command', [('command_name', 'check_dummy'), ('command_line', '/bin/true')])
+        for level in range(depth):
+            host = [('name', 'host-template-%d' % (level, )), ('register', '0'), ('notes', 'level %d' % (level, ))]
+            service = [('name', 'service-template-%d' % (level, )), ('register', '0'), ('notes', 'level %d' % (level, ))]
+            if level:
+                host.append(('use', 'host-template-%d' % (level - 1, )))
+                service.append(('use', 'service-template-%d' % (level - 1, )))
+            else:
+                host += [('check_command', 'check_dummy'), ('max_check_attempts', '3'), ('check_interval', '5')]
+                service += [('check_command', 'check_dummy'), ('max_check_attempts', '3'), ('check_interval', '1')]
+            define(fh, 'host', host)
+            define(fh, 'service', service)
+
+    with open(os.path.join(objects, 'hostgroups.cfg'), 'w') as fh:
+        for group in range(groups):
+            define(fh, 'hostgroup', [('hostgroup_name', 'group%03d' % (group, )), ('alias', 'group %d' % (group, ))])
+
+    for number in range(hosts):
+        host_name = 'host%05d' % (number, )
+        with open(os.path.join(objects, 'hosts', '%s.cfg' % (host_name, )), 'w') as fh:
+            hostgroups = sorted(set(['group%03d' % (number % groups, ), 'group%03d' % ((number * 7 + 1) % groups, )]))
+            define(fh, 'host', [
+                ('host_name', host_name),
+                ('use', 'host-template-%d' % (depth - 1, )),
+                ('address', '10.%d.%d.%d' % (number >> 16 & 255, number >> 8 & 255, number & 255)),
+                ('hostgroups', ','.join(hostgroups)),
+            ])
+            for service in range(services):
+                define(fh, 'service', [
+                    ('host_name', host_name),
+                    ('service_description', 'service%03d' % (service, )),
+                    ('use', 'service-template-%d' % (depth - 1, )),
+                ])
+
+    nagios_cfg = os.path.join(directory, 'nagios.cfg')
+    with open(nagios_cfg, 'w') as fh:
+        fh.write("cfg_dir=%s\n" % (objects, ))
+        fh.write("command_file=%s\n" % (os.path.join(directory, 'nagios.cmd'), ))
+        fh.write("illegal_object_name_chars=`~!$%^&*|'\"<>?,()=\n")
+    return nagios_cfg
+
+def configure(directory, nagios_cfg, auth_cache=0, interval=1):
+    """ write a stub nagios binary and a config.json for the api, returns its path """
+    nagios_bin = os.path.join(directory, 'nagios')
+    with open(nagios_bin, 'w') as fh:
+        fh.write("#!/bin/sh\necho 'Total Warnings: 0'\necho 'Total Errors:   0'\n")
+    os.chmod(nagios_bin, 0755)
+
+    filename = os.path.join(directory, 'config.json')
+    with open(filename, 'w') as fh:
+        json.dump({
+            'nagios_main_cfg': nagios_cfg,
+            'nagios_bin': nagios_bin,
+            'output_dir': os.path.join(directory, 'objects', 'api'),
+            'index': {'interval': interval},
+            'auth': {'provider': 'AuthDict', 'params': {}, 'cache': {'ttl': auth_cache}},
+        }, fh, indent=4)
+    return filename
+
+def percentile(values, fraction):
+    """ nearest-rank percentile of a sorted list """
+    return values[max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))]
+
+def statistics(samples, objects=1):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'requests': len(samples),
+        'objects_per_request': objects,
+        'seconds': total,
+        'requests_per_second': len(samples) / total if total else None,
+        'objects_per_second': len(samples) * objects / total if total and objects else None,
+        'min_ms': samples[0] * 1000,
+        'mean_ms': total / len(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p90_ms': percentile(samples, 0.90) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+class Benchmark(object):
+    """
+    Benchmark: drives the api through the flask test client and collects
+    the latency of every request per scenario
+    """
+
+    def __init__(self, app, hosts, services, groups, iterations, bulk):
+        self.client = app.test_client()
+        self.hosts = hosts
+        self.services = services
+        self.groups = groups
+        self.iterations = iterations
+        self.bulk = min(bulk, hosts)
+        self.headers = {'Authorization': 'Basic ' + base64.b64encode('admin:password')}
+        self.random = random.Random(42)
+
+    def request(self, method, url, data=None):
+        kwargs = {'headers': self.headers}
+        if data is not None:
+            kwargs.update(data=json.dumps(data), content_type='application/json')
+        start = timer()
+        response = getattr(self.client, method)(url, **kwargs)
+        response.get_data()
+        # the test client leaves closing to the caller, admission slots are only given back on close
+        response.close()
+        elapsed = timer() - start
+        if response.status_code >= 400 and response.status_code != 404:
+            raise Exception("%s %s failed with %d: %s" % (method.upper(), url, response.status_code, response.get_data()[:200]))
+        return elapsed, response
+
+    def host(self):
+        return 'host%05d' % (self.random.randrange(self.hosts), )
+
+    def run(self, scenarios):
+        results = {}
+        results['load'] = statistics([self.request('get', '/host?host_name=%s' % (self.host(), ))[0]])
+
+        for scenario in scenarios:
+            try:
+                samples, objects = getattr(self, 'scenario_' + scenario)()
+            except Exception, err:
+                # the other scenarios still run, the failed one is reported with its error
+                results[scenario] = {'error': str(err)}
+                sys.stderr.write("%-14s failed: %s\n" % (scenario, str(err)))
+                continue
+            results[scenario] = statistics(samples, objects)
+            sys.stderr.write("%-14s p50 %8.2fms  p99 %8.2fms  %8.1f req/s\n" % (
+                scenario, results[scenario]['p50_ms'], results[scenario]['p99_ms'], results[scenario]['requests_per_second']))
+        return results
+
+    def scenario_get_exact(self):
+        return [self.request('get', '/host?host_name=%s' % (self.host(), ))[0] for i in range(self.iterations)], 1
+
+    def scenario_get_wildcard(self):
+        # every prefix matches 10 hosts and their services
+        prefixes = ['/service?host_name=%s*' % (self.host()[:-1], ) for i in range(self.iterations)]
+        return [self.request('get', url)[0] for url in prefixes], min(10, self.hosts) * self.services
+
+    def scenario_get_relation(self):
+        urls = ['/host?hostgroups__has_field=group%03d&_fields=host_name' % (self.random.randrange(self.groups), ) for i in range(self.iterations)]
+        return [self.request('get', url)[0] for url in urls], None
+
+    def scenario_count(self):
+        return [self.request('get', '/service?_group_by=host_name')[0] for i in range(self.iterations)], None
+
+    def _rounds(self):
+        return max(1, self.iterations // 10)
+
+    def scenario_bulk_post(self):
+        samples = []
+        for round in range(self._rounds()):
+            hosts = self.random.sample(range(self.hosts), self.bulk)
+            data = [
+                {'host_name': 'host%05d' % (host, ), 'service_description': 'bench%03d-%05d' % (round, host), 'use': 'service-template-0'}
+                for host in hosts
+            ]
+            samples.append(self.request('post', '/service', data)[0])
+        return samples, self.bulk
+
+    def scenario_bulk_delete(self):
+        # removes the services created by bulk_post, one wildcard per round
+        return [self.request('delete', '/service?service_description=bench%03d-*' % (round, ))[0] for round in range(self._rounds())], self.bulk
+
+    def scenario_auth(self):
+        # no new changes since the last one: authentication and routing with next to no work in the view
+        last = json.loads(self.request('get', '/changes')[1].get_data())['last']
+        return [self.request('get', '/changes?since=%d' % (last, ))[0] for i in range(self.iterations)], 1
+
+    def scenario_verify(self):
+        samples = []
+        for round in range(self._rounds()):
+            # change the configuration first, a verify of an unchanged configuration is answered from the cache
+            self.request('post', '/host', {'host_name': self.host(), 'notes': 'verify %d' % (round, )})
+            samples.append(self.request('post', '/control?verify')[0])
+        return samples, 1
+
+scenarios = ['get_exact', 'get_wildcard', 'get_relation', 'count', 'bulk_post', 'bulk_delete', 'auth', 'verify']
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the RESTlos api with a synthetic configuration')
+    parser.add_argument('--hosts', type=int, default=1000, help='number of hosts (default: 1000)')
+    parser.add_argument('--services', type=int, default=10, help='services per host (default: 10)')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the template chains (default: 3)')
+    parser.add_argument('--groups', type=int, default=10, help='number of hostgroups (default: 10)')
+    parser.add_argument('--iterations', type=int, default=200, help='requests per read scenario, a tenth of it for writes (default: 200)')
+    parser.add_argument('--bulk', type=int, default=100, help='objects per bulk request (default: 100)')
+    parser.add_argument('--auth-cache', type=int, default=0, help='ttl of the credential cache, 0 disables it (default: 0)')
+    parser.add_argument('--interval', type=float, default=1, help='index.interval of the api (default: 1)')
+    parser.add_argument('--scenarios', default=','.join(scenarios), help='comma separated list of scenarios (default: all)')
+    parser.add_argument('--workdir', help='directory for the generated configuration (default: temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='do not remove the generated configuration')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    selected = [scenario for scenario in args.scenarios.split(',') if scenario]
+    unknown = set(selected) - set(scenarios)
+    if unknown:
+        parser.error('unknown scenarios: %s' % (', '.join(sorted(unknown)), ))
+
+    directory = args.workdir or tempfile.mkdtemp(prefix='restlos-benchmark-')
+
+    try:
+        start = timer()
+        nagios_cfg = generate(directory, args.hosts, args.services, args.depth, args.groups)
+        sys.stderr.write("generated %d hosts and %d services in %.2fs\n" % (args.hosts, args.hosts * args.services, timer() - start))
+
+        # the api reads its configuration on import
+        os.environ['RESTLOS_CONFIG'] = configure(directory, nagios_cfg, args.auth_cache, args.interval)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import restlosapi
+
+        # logging is merged with the defaults (syslog), replace it to keep the audit log out of the measurement
+        restlosapi.config['logging'] = {
+            'version': 1,
+            'handlers': {'console': {'level': 'ERROR', 'class': 'logging.StreamHandler'}},
+            'root': {'level': 'ERROR', 'handlers': ['console']},
+        }
+        app = restlosapi.NagiosAPI('restlosapi')
+        benchmark = Benchmark(app, args.hosts, args.services, args.groups, args.iterations, args.bulk)
+        results = benchmark.run(selected)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(directory, True)
+
+    report = {
+        'version': restlosapi.VERSION,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': dict([(key, value) for key, value in vars(args).iteritems() if key not in ('output', 'workdir', 'keep')]),
+        'objects': args.hosts * (args.services + 1) + args.groups + 2 * args.depth + 1,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=4, sort_keys=True)
+    else:
+        print json.dumps(report, indent=4, sort_keys=True)
+
+    if any(['error' in result for result in results.values()]):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ldap_standin.py: a minimal, local stand-in for an ldap server which only
+knows simple binds and equality searches, enough to exercise AuthLDAP and
+its connection pool without a real directory. Users are given as
+uid:password[:group,group] and found below --basedn.
+
+usage: contrib/ldap_standin.py --port 3389 --user admin:secret:admins
+       contrib/ldap_standin.py --check
+
+With --check, the server is started on a free port and AuthLDAP (which
+needs python-ldap) is run against it: logins, group checks and a restart
+of the server between two logins. The results are written as JSON.
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+import SocketServer
+
+# ldap result codes
+SUCCESS = 0
+INVALID_CREDENTIALS = 49
+UNWILLING_TO_PERFORM = 53
+
+def ber(tag, payload):
+    """ one BER encoded element with definite length """
+    length = len(payload)
+    if length < 0x80:
+        return chr(tag) + chr(length) + payload
+    octets = ''
+    while length:
+        octets = chr(length & 0xff) + octets
+        length >>= 8
+    return chr(tag) + chr(0x80 | len(octets)) + octets + payload
+
+def ber_integer(value, tag=0x02):
+    octets = ''
+    while True:
+        octets = chr(value & 0xff) + octets
+        value >>= 8
+        if (value == 0 and not ord(octets[0]) & 0x80) or (value == -1 and ord(octets[0]) & 0x80):
+            return ber(tag, octets)
+
+def ber_string(value, tag=0x04):
+    return ber(tag, value)
+
+def ber_read(data, offset=0):
+    """ decode the element at offset, returns (tag, value, offset of the next element) """
+    tag = ord(data[offset])
+    length = ord(data[offset + 1])
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        length = 0
+        for octet in data[offset:offset + count]:
+            length = length << 8 | ord(octet)
+        offset += count
+    return tag, data[offset:offset + length], offset + length
+
+def ber_elements(data):
+    """ all elements of a constructed value as (tag, value) """
+    elements = []
+    offset = 0
+    while offset < len(data):
+        tag, value, offset = ber_read(data, offset)
+        elements.append((tag, value))
+    return elements
+
+def ber_decode_integer(data):
+    value = 0
+    for octet in data:
+        value = value << 8 | ord(octet)
+    if data and ord(data[0]) & 0x80:
+        value -= 1 << (8 * len(data))
+    return value
+
+def ldap_result(tag, code, message=''):
+    return ber(tag, ber_integer(code, 0x0a) + ber_string('') + ber_string(message))
+
+
+class Directory(object):
+    """
+    Directory: the users (uid -> password, groups) and service accounts
+    (dn -> password) of the stand-in server
+    """
+
+    def __init__(self, basedn='dc=example,dc=com', userattr='uid', groupattr='memberof'):
+        self.basedn = basedn
+        self.userattr = userattr
+        self.groupattr = groupattr
+        self.users = {}
+        self.accounts = {}
+
+    def add_user(self, uid, password, groups=()):
+        self.users[uid] = (password, list(groups))
+
+    def add_account(self, dn, password):
+        self.accounts[dn.lower()] = password
+
+    def _user(self, dn):
+        """ uid of a dn below basedn (ex: uid=admin,dc=example,dc=com) """
+        rdn, _, parent = dn.partition(',')
+        attribute, _, value = rdn.partition('=')
+        if attribute.strip().lower() != self.userattr.lower() or parent.strip().lower() != self.basedn.lower():
+            return None
+        # escape_dn_chars() escapes with backslashes
+        return value.replace('\\', '')
+
+    def bind(self, dn, password):
+        if not password:
+            return False
+        if dn.lower() in self.accounts:
+            return self.accounts[dn.lower()] == password
+        uid = self._user(dn)
+        return uid in self.users and self.users[uid][0] == password
+
+    def search(self, attribute, value):
+        """ entries matching an equality filter as (dn, {attribute: [values]}) """
+        if attribute.lower() != self.userattr.lower() or value not in self.users:
+            return []
+        return [('%s=%s,%s' % (self.userattr, value, self.basedn), {self.groupattr: self.users[value][1]})]
+
+
+class LDAPHandler(SocketServer.BaseRequestHandler):
+    """ LDAPHandler: answers the ldap messages of one connection """
+
+    def setup(self):
+        self.bound = False
+        self.server.connections.add(self.request)
+
+    def finish(self):
+        self.server.connections.discard(self.request)
+
+    def _read(self, count):
+        data = ''
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _message(self):
+        header = self._read(2)
+        length = ord(header[1])
+        if length & 0x80:
+            octets = self._read(length & 0x7f)
+            header += octets
+            length = 0
+            for octet in octets:
+                length = length << 8 | ord(octet)
+        return ber_read(header + self._read(length))[1]
+
+    def _send(self, message_id, *operations):
+        for operation in operations:
+            self.request.sendall(ber(0x30, ber_integer(message_id) + operation))
+
+    def _bind(self, message_id, request):
+        elements = ber_elements(request)
+        dn = elements[1][1]
+        if elements[2][0] != 0x80:
+            return self._send(message_id, ldap_result(0x61, UNWILLING_TO_PERFORM, 'only simple binds are supported'))
+        self.bound = self.server.directory.bind(dn, elements[2][1])
+        self._send(message_id, ldap_result(0x61, SUCCESS if self.bound else INVALID_CREDENTIALS))
+
+    def _search(self, message_id, request):
+        elements = ber_elements(request)
+        if not self.bound:
+            return self._send(message_id, ldap_result(0x65, INVALID_CREDENTIALS, 'bind first'))
+
+        tag, condition = elements[6]
+        if tag != 0xa3:
+            return self._send(message_id, ldap_result(0x65, UNWILLING_TO_PERFORM, 'only equality filters are supported'))
+        (_, attribute), (_, value) = ber_elements(condition)
+        wanted = [name.lower() for tag, name in ber_elements(elements[7][1])]
+
+        responses = []
+        for dn, attributes in self.server.directory.search(attribute, value):
+            encoded = ''.join([
+                ber(0x30, ber_string(name) + ber(0x31, ''.join([ber_string(item) for item in values])))
+                for name, values in attributes.iteritems() if not wanted or name.lower() in wanted
+            ])
+            responses.append(ber(0x64, ber_string(dn) + ber(0x30, encoded)))
+        responses.append(ldap_result(0x65, SUCCESS))
+        self._send(message_id, *responses)
+
+    def handle(self):
+        while True:
+            try:
+                message = ber_elements(self._message())
+            except (EOFError, socket.error, IndexError):
+                return
+
+            message_id = ber_decode_integer(message[0][1])
+            tag, request = message[1]
+            if tag == 0x60:
+                self._bind(message_id, request)
+            elif tag == 0x63:
+                self._search(message_id, request)
+            else:
+                # unbind or an unsupported operation
+                return
+
+
+class StandinServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    StandinServer: the stand-in ldap server, restart() closes all client
+    connections (like a restart of a real server) and keeps listening
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, directory):
+        SocketServer.TCPServer.__init__(self, address, LDAPHandler)
+        self.directory = directory
+        self.connections = set()
+
+    def restart(self):
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            connection.close()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='ldap-standin')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def check(basedn):
+    """ run AuthLDAP against a stand-in server, returns the results of all steps """
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.authentication.ldapauth import AuthLDAP
+
+    directory = Directory(basedn)
+    directory.add_user('admin', 'secret', ['admins'])
+    directory.add_user('guest', 'guest', ['guests'])
+    directory.add_account('cn=restlos,' + basedn, 'service')
+
+    server = StandinServer(('127.0.0.1', 0), directory)
+    server.start()
+    port = server.server_address[1]
+
+    def fill(pool):
+        """ open and use all connections of the pool, they all go stale with the restart """
+        connections = [pool.acquire() for i in range(pool.size)]
+        for connection in connections:
+            connection.simple_bind_s('uid=admin,' + basedn, 'secret')
+            pool.release(connection)
+        return pool.idle.qsize() == pool.size
+
+    results = []
+    for binddn in ('', 'cn=restlos,' + basedn):
+        auth = AuthLDAP(
+            ldapserver='127.0.0.1', port=port, ssl=False, basedn=basedn, searchdn=basedn,
+            groups=['admins'], binddn=binddn, bindpw='service' if binddn else '', pool_size=2, timeout=2
+        )
+        steps = [
+            ('login', lambda: auth.authenticate('admin', 'secret'), True),
+            ('wrong password', lambda: auth.authenticate('admin', 'wrong'), False),
+            ('unknown user', lambda: auth.authenticate('nobody', 'secret'), False),
+            ('not in group', lambda: auth.authenticate('guest', 'guest'), False),
+            ('fill pool', lambda: fill(auth.pool), True),
+            ('restart', lambda: server.restart() or True, True),
+            ('login after restart', lambda: auth.authenticate('admin', 'secret'), True),
+        ]
+        for name, step, expected in steps:
+            result = step()
+            results.append({'step': name, 'binddn': binddn or None, 'result': result, 'ok': result == expected})
+
+    server.shutdown()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='minimal stand-in ldap server for testing AuthLDAP')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=3389, help='port to listen on (default: 3389)')
+    parser.add_argument('--basedn', default='dc=example,dc=com', help='dn below which the users are (default: dc=example,dc=com)')
+    parser.add_argument('--user', action='append', default=[], help='uid:password[:group,group], can be given several times')
+    parser.add_argument('--account', action='append', default=[], help='dn:password of a service account (binddn)')
+    parser.add_argument('--check', action='store_true', help='run AuthLDAP against the stand-in and report the results')
+    args = parser.parse_args()
+
+    if args.check:
+        results = check(args.basedn)
+        print json.dumps(results, indent=4)
+        sys.exit(0 if all([result['ok'] for result in results]) else 1)
+
+    directory = Directory(args.basedn)
+    for user in args.user:
+        uid, password, groups = (user.split(':', 2) + [''])[:3]
+        directory.add_user(uid, password, [group for group in groups.split(',') if group])
+    for account in args.account:
+        dn, _, password = account.rpartition(':')
+        directory.add_account(dn, password)
+
+    server = StandinServer((args.host, args.port), directory)
+    sys.stderr.write("ldap stand-in listening on %s:%d\n" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
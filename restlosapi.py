@@ -1,29 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
-from flask import Flask, request, render_template, jsonify, abort
+from flask import Flask, request, render_template, jsonify, abort, current_app, g
 from flask import Request, Response
 from flask.views import MethodView
 
 from werkzeug.exceptions import HTTPException, InternalServerError
 from werkzeug.exceptions import default_exceptions, BadRequest
 
-from utils import Config
+from utils import Config, ObjectIndex, ConfigWriter, Query, JobQueue, RestartScheduler, ChangeLog, registry
+from utils import ProfileStore, Profiler, SharedLock, content_encodings, compress, pack_msgpack, has_msgpack
+from utils import LazyModule, AdmissionControl
 from utils.authentication import Authentify
 
 from subprocess import check_output, CalledProcessError
 
-from pynag import Model, Parsers
-from json import dumps
+from json import dumps, loads
+from hashlib import sha1
+from itertools import islice
+from functools import partial
+from collections import OrderedDict
 from cgi import escape
+from timeit import default_timer as timer
 
 import os
+import re
+import imp
+import pstats
+import tempfile
+import time
 import logging
 import logging.config
 
-config = Config(os.path.join(os.path.dirname(__file__), 'config.json'))
+config = Config(os.environ.get('RESTLOS_CONFIG', os.path.join(os.path.dirname(__file__), 'config.json')))
 VERSION="0.3"
 
+# pynag is imported on first use, not on start (see the schema cache)
+Model = LazyModule('pynag.Model')
+Parsers = LazyModule('pynag.Parsers')
+Command = LazyModule('pynag.Control.Command')
+
 class JSONHTTPException(HTTPException):
     """ JSONHTTPException: this exception provides a detailed error message
     if a json parsing error occures. More helpful that just the standard 400
@@ -47,54 +63,316 @@ class CustomRequestClass(Request):
 
 
 class ApiEndpoints(dict):
-    """ ApiEndpoints: provides a dictionary for the available api endpoints.
-    it also defines unique keys for the available nagios objects and some
-    convenient functions for retrieving unique keys or validating object
-    attributes.
+    """ ApiEndpoints: provides an immutable dictionary for the available api
+    endpoints, mapping every endpoint to a frozenset of its attributes. It is
+    built once per process by the app and shared by all views. It also defines
+    unique keys for the available nagios objects and some convenient functions
+    for retrieving unique keys or validating object attributes.
+
+    @cache: optional file caching the attributes and the values of nagios.cfg,
+    valid as long as nagios.cfg and the attribute definitions of pynag are
+    unchanged. Saves importing pynag.Model and parsing nagios.cfg on start.
     """
 
     main_cfg_values = {}
 
-    def __init__(self):
+    # format of the schema cache, increment on incompatible changes
+    schema_version = 1
+
+    # unique keys of the nagios objects
+    endpoint_keys = {
+        'hostgroup':'hostgroup_name',
+        'hostextinfo':'host_name',
+        'host':'host_name',
+        'service':'service_description',
+        'servicegroup':'servicegroup_name',
+        'contact':'contact_name',
+        'contactgroup':'contactgroup_name',
+        'timeperiod':'timeperiod_name',
+        'command':'command_name',
+    }
+
+    # list valued attributes linking objects to each other
+    relation_keys = {
+        'host': ['hostgroups', 'parents', 'contacts', 'contact_groups', 'use'],
+        'service': ['host_name', 'hostgroup_name', 'servicegroups', 'contacts', 'contact_groups', 'use'],
+        'hostgroup': ['members', 'hostgroup_members', 'use'],
+        'servicegroup': ['members', 'servicegroup_members', 'use'],
+        'contact': ['contactgroups', 'use'],
+        'contactgroup': ['members', 'contactgroup_members', 'use'],
+    }
+
+    def __init__(self, cache=None):
+        if not config['nagios_main_cfg']:
+            cache = None
+
+        schema = self._load_schema(cache) if cache else None
+        if schema is None:
+            schema = self._build_schema()
+            if cache:
+                self._save_schema(cache, schema)
+
         # create a map of valid endpoints/arguments
-        for endpoint in Model.all_attributes.object_definitions.keys():
-            self[endpoint] = Model.all_attributes.object_definitions[endpoint].keys()
-            self[endpoint] += Model.all_attributes.object_definitions["any"]
-        del self["any"]
+        dict.__init__(self, [
+            (str(endpoint), frozenset(attributes)) for endpoint, attributes in schema['endpoints'].iteritems()
+        ])
 
         if not self.main_cfg_values:
-            parser = Parsers.config(config['nagios_main_cfg'])
-            parser.parse()
-            self.main_cfg_values.update(dict(parser.maincfg_values))
-
-        # set endpoint keys
-        self.endpoint_keys = {
-            'hostgroup':'hostgroup_name',
-            'hostextinfo':'host_name',
-            'host':'host_name',
-            'service':'service_description',
-            'servicegroup':'servicegroup_name',
-            'contact':'contact_name',
-            'contactgroup':'contactgroup_name',
-            'timeperiod':'timeperiod_name',
-            'command':'command_name',
+            self.main_cfg_values.update(schema['main_cfg_values'])
+
+        # wildcards are allowed in unique keys and will be stripped out
+        illegal_chars = self.main_cfg_values.get('illegal_object_name_chars', '').replace('*', '')
+        self.illegal_chars = re.compile('[%s]' % (re.escape(illegal_chars), )) if illegal_chars else None
+
+        self.help = dict([(endpoint, sorted(attributes)) for endpoint, attributes in self.iteritems()])
+
+    def _build_schema(self):
+        definitions = Model.all_attributes.object_definitions
+        schema = {
+            'endpoints': dict([
+                (endpoint, sorted(set(attributes.keys()) | set(definitions["any"])))
+                for endpoint, attributes in definitions.iteritems() if endpoint != "any"
+            ]),
+            'main_cfg_values': self.main_cfg_values,
         }
 
+        if not self.main_cfg_values:
+            parser = Parsers.config(config['nagios_main_cfg'])
+            parser.parse_maincfg()
+            schema['main_cfg_values'] = dict(parser.maincfg_values)
+        return schema
+
+    def _schema_key(self):
+        """ what the cached schema depends on, the files are compared by mtime, size and inode """
+        attributes = os.path.join(imp.find_module('pynag')[1], 'Model', 'all_attributes.py')
+        stamps = []
+        for filename in (config['nagios_main_cfg'], attributes):
+            result = os.stat(filename)
+            stamps.append([filename, result.st_mtime, result.st_size, result.st_ino])
+        return [self.schema_version, stamps]
+
+    def _load_schema(self, cache):
+        try:
+            with open(cache, 'r') as fh:
+                schema = loads(fh.read())
+            if schema.get('key') == self._schema_key():
+                return schema
+        except (IOError, OSError, ImportError, ValueError, AttributeError), err:
+            logging.debug("schema cache %s not used (%s)" % (cache, str(err)))
+        return None
+
+    def _save_schema(self, cache, schema):
+        """ write the cache atomically, processes starting at the same time never read a partial file """
+        try:
+            fd, filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)), prefix='.schema')
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(dumps(dict(schema, key=self._schema_key())))
+            os.rename(filename, cache)
+        except (IOError, OSError, ImportError), err:
+            logging.warning("unable to write the schema cache %s (%s)" % (cache, str(err)))
+
+    def __setitem__(self, key, value):
+        raise TypeError('ApiEndpoints is immutable')
+
+    def __delitem__(self, key):
+        raise TypeError('ApiEndpoints is immutable')
+
     def get_unique_key(self, endpoint):
         return self.endpoint_keys[endpoint]
 
     def validate(self, endpoint, data={}):
+        attributes = self[endpoint]
         for attr in data.keys():
-            if not attr.startswith('_') and attr not in self[endpoint]:
+            if not attr.startswith('_') and attr not in attributes:
                 return {404: "unknown attribute: %s" % (attr, )}
-            if attr == self.endpoint_keys[endpoint]:
-                for illegal_char in self.main_cfg_values.get('illegal_object_name_chars', []):
-                    if illegal_char in list(data[attr]):
-                        if illegal_char == '*': continue # wildcards are allowed and will be stripped out
-                        return {400: "illegal character (%s) found in attribute %s" % (illegal_char, attr)}
+
+        unique_key = self.endpoint_keys[endpoint]
+        if self.illegal_chars and unique_key in data:
+            match = self.illegal_chars.search(data[unique_key])
+            if match:
+                return {400: "illegal character (%s) found in attribute %s" % (match.group(), unique_key)}
         return {200: "OK"}
 
 
+# latency of the request handling, exposed at /metrics
+request_duration = registry.histogram(
+    'restlos_http_request_duration_seconds',
+    'time spent answering requests, including streaming the response',
+    ['endpoint', 'method', 'status']
+)
+phase_duration = registry.histogram(
+    'restlos_view_phase_seconds',
+    'time spent in the phases of object requests (validate, etag, filter, serialize, save, delete)',
+    ['endpoint', 'phase']
+)
+control_duration = registry.histogram(
+    'restlos_control_duration_seconds',
+    'time spent in the actions of the control endpoint',
+    ['action']
+)
+verify_duration = registry.histogram(
+    'restlos_verify_run_seconds',
+    'time spent running the configuration check of the core',
+    ['returncode']
+)
+
+# authentication of all views, one provider (and credential cache, connection pool) per process
+authentify = Authentify(config['auth'])
+
+# profiles of requested and slow requests, see /profiles
+profiles = ProfileStore(config['profiling']['size'])
+profiler = Profiler(config['profiling'], profiles)
+
+def exact_query(arguments):
+    """ do the query arguments only match exact values (ex: host_name=web01, host_name__in=web01,web02) """
+    conditions = [(key, value) for key, value in arguments if not key.startswith('_')]
+    for key, value in conditions:
+        if Query.split(key)[1] not in (None, 'in') or not isinstance(value, basestring) or value.startswith('*') or value.endswith('*'):
+            return False
+    return bool(conditions)
+
+def classify_request():
+    """
+    Cost class of the current request for the admission control: read,
+    scan, write, bulk or control (see config['admission'])
+    """
+    if request.endpoint == 'control':
+        # a verify holds its worker until the core is done, unless the result is cached already.
+        # async verifies return right away, restarts only wait for a verify if restart.verify is set
+        verify = 'verify' in request.args and request.args['verify'] != 'async'
+        if request.method == 'POST' and (verify or ('restart' in request.args and config['restart']['verify'])):
+            try:
+                job = verify_jobs.find(index.fingerprint())
+            except IOError:
+                # the view reports the missing configuration
+                return 'control'
+            return 'read' if job is not None and job.status == 'finished' else 'control'
+        return 'read'
+    if request.method == 'GET':
+        return 'read' if exact_query(request.args.iteritems()) else 'scan'
+
+    data = request.get_json(silent=True)
+    if request.method == 'DELETE':
+        return 'write' if exact_query(request.args.iteritems()) else 'bulk'
+    if request.endpoint == 'batch':
+        operations = [operation for operation in data if isinstance(operation, dict)] if isinstance(data, list) else []
+        for operation in operations:
+            if operation.get('op') == 'delete' and not exact_query((operation.get('query') or {}).items()):
+                return 'bulk'
+        size = sum([len(operation['data']) if isinstance(operation.get('data'), list) else 1 for operation in operations])
+    else:
+        size = len(data) if isinstance(data, list) else 1
+    return 'bulk' if size > config['admission']['bulk_size'] else 'write'
+
+# concurrency limits of the cost classes
+admission = AdmissionControl(config['admission'], classify_request)
+
+# lock file of all processes (ex: uwsgi workers), serializes their writes to the files and the change log
+shared_lock = SharedLock(config['index']['lock_file']) if config['index']['lock_file'] else None
+
+# changes of objects, made through the api or detected in the files
+changes = ChangeLog(config['changes']['size'], config['changes']['file'], shared_lock)
+
+# process-wide object index shared by all views, coordinated with other processes by the lock file
+index = ObjectIndex(
+    config['nagios_main_cfg'],
+    ApiEndpoints.endpoint_keys,
+    ApiEndpoints.relation_keys,
+    config['index']['interval'],
+    changes,
+    config['index']['snapshot'],
+    shared_lock
+)
+
+# background verify runs, deduplicated by the state of the configuration files
+verify_jobs = JobQueue()
+
+def verify_config():
+    """ verify the configuration, sharing the run with all requests for the same configuration state """
+    job = verify_jobs.submit(index.fingerprint(), NagiosControlView._run_verify)
+    job.wait()
+    if job.status == 'failed':
+        raise Exception(job.result)
+    return job.result
+
+def refresh_index():
+    """ refresh the index, aborts with 500 if the configuration files can not be read """
+    try:
+        index.refresh()
+    except IOError, err:
+        abort(500, "error opening config files: %s" % (str(err), ))
+    except:
+        abort(500)
+
+def number_argument(name, default=None, convert=int):
+    """ a non-negative number from the request arguments, aborts with 400 on anything else """
+    try:
+        value = convert(request.args.get(name, default))
+    except (TypeError, ValueError):
+        abort(400, 'invalid value for %s: %s' % (name, escape(request.args.get(name))))
+    if value < 0:
+        abort(400, 'invalid value for %s: %s' % (name, escape(request.args.get(name))))
+    return value
+
+# coalesces restart requests of the control endpoint
+restart_scheduler = RestartScheduler(
+    config['restart']['window'],
+    verify_config if config['restart']['verify'] else None
+)
+
+# response formats of GET requests (and /help) and their mimetypes
+response_formats = OrderedDict([
+    ('json', 'application/json'),
+    ('ndjson', 'application/x-ndjson'),
+    ('msgpack', 'application/x-msgpack'),
+])
+
+def negotiate(formats=response_formats.keys()):
+    """
+    The representation of a response as (format, indent, encoding): one of
+    formats from ?_format or the Accept header, pretty printed JSON unless
+    the request is XHR or ?_pretty=0 and the content coding from
+    Accept-Encoding (None if the response is sent uncompressed)
+    """
+    mimetypes = OrderedDict([(response_formats[name], name) for name in formats])
+    if 'msgpack' in formats:
+        mimetypes['application/msgpack'] = 'msgpack'
+
+    fmt = request.args.get('_format')
+    if fmt is None:
+        fmt = mimetypes.get(request.accept_mimetypes.best_match(mimetypes.keys()), formats[0])
+    elif fmt not in formats:
+        abort(400, 'invalid value for _format: %s' % (escape(fmt), ))
+    if fmt == 'msgpack' and not has_msgpack():
+        abort(406, 'msgpack is not available, install the msgpack module')
+
+    pretty = request.args.get('_pretty', '0' if request.is_xhr else '1')
+    if pretty not in ('0', '1'):
+        abort(400, 'invalid value for _pretty: %s' % (escape(pretty), ))
+    indent = 2 if fmt == 'json' and pretty == '1' else None
+
+    encoding = None
+    if config['compression']['enabled']:
+        encoding = request.accept_encodings.best_match(content_encodings.keys())
+    return fmt, indent, encoding
+
+def streamed_response(chunks, fmt, encoding=None, histogram=None):
+    """
+    Response streaming chunks, compressed on the fly with encoding. If
+    histogram is set, it observes the time spent producing the body
+    """
+    if encoding is not None:
+        chunks = compress(chunks, encoding, config['compression']['level'])
+    if histogram is not None:
+        chunks = histogram.iterate(chunks)
+
+    response = Response(chunks, mimetype=response_formats[fmt])
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(['Accept', 'Accept-Encoding'])
+    return response
+
+
 class NagiosControlView(MethodView):
     """
     NagiosControlView: Provides a view function which is registered as an api
@@ -102,19 +380,12 @@ class NagiosControlView(MethodView):
     like reloading the core or verify the configuration
     """
 
-    decorators = [Authentify(config['auth'])]
+    decorators = [profiler, admission, authentify]
 
-    def __init__(self, *args, **kwargs):
-        MethodView.__init__(self, *args, **kwargs)
-
-        try:
-            self.command_file = Model.Control.Command.find_command_file(config['nagios_main_cfg'])
-        except Exception, err:
-            abort(500, 'unable to locate command file: %s' % (str(err), ))
-
-        self.arguments = ['verify', 'restart']
+    arguments = ['verify', 'restart']
 
-    def _format(self, data):
+    @classmethod
+    def _format(cls, data):
         result = {'Error': [], 'Warning': [], 'Total Errors': [], 'Total Warnings': []}
         for line in data.split('\n'):
             for key in result.keys():
@@ -130,40 +401,83 @@ class NagiosControlView(MethodView):
         return result
 
     def _verify(self):
+        """
+        Verify runs as a background job, shared by all requests for the same
+        configuration state. The result of an unchanged configuration is
+        served from the job cache. With verify=async the job is returned
+        right away, its state can be polled at /control/jobs/<id>. If the
+        core could not be run at all, the job fails and is not cached
+        """
+        if request.args.get('verify') == 'async':
+            return verify_jobs.submit(index.fingerprint(), self._run_verify).as_dict()
         try:
-            if config['sudo']:
-                output = check_output(['sudo', config['nagios_bin'], '-v', config['nagios_main_cfg']])
-            else:
-                print [config['nagios_bin'], '-v', config['nagios_main_cfg']]
-                output = check_output([config['nagios_bin'], '-v', config['nagios_main_cfg']])
+            return verify_config()
+        except Exception, err:
+            return {'output': str(err), 'returncode': 255}
+
+    @classmethod
+    def _run_verify(cls):
+        command = [config['nagios_bin'], '-v', config['nagios_main_cfg']]
+        if config['sudo']:
+            command.insert(0, 'sudo')
+        logging.debug("running the configuration check: %s" % (command, ))
+
+        start = timer()
+        try:
+            output = check_output(command)
             returncode = 0
         except CalledProcessError, err:
             output = err.output
             returncode = err.returncode
         except Exception, err:
-            output = str(err)
-            returncode = 255
+            # the core did not run (ex: missing binary), fail the job instead of caching the error
+            verify_duration.labels(255).observe(timer() - start)
+            raise Exception('unable to run %s: %s' % (config['nagios_bin'], str(err)))
 
-        result = self._format(output)
+        verify_duration.labels(returncode).observe(timer() - start)
+        result = cls._format(output)
 
         return {'output': result if result else output, 'returncode': returncode}
 
     def _restart(self):
+        """
+        Restart requests are coalesced by the restart scheduler: all requests
+        within the configured window result in a single restart. The command
+        file is only looked up here, reading jobs does not need it
+        """
+        try:
+            command_file = Command.find_command_file(config['nagios_main_cfg'])
+        except Exception, err:
+            raise Exception('unable to locate command file: %s' % (str(err), ))
+
         logging.warn("[audit] [user: %s] triggered the restart command" % (request.authorization.username), )
-        Model.Control.Command.restart_program(command_file=self.command_file)
-        return { 'result': 'successfully sent command to command file' }
+        state = restart_scheduler.request(
+            request.authorization.username,
+            partial(Command.restart_program, command_file=command_file)
+        )
+        if state['pending']:
+            return { 'result': 'restart scheduled', 'restart': state }
+        return { 'result': state['last']['message'], 'restart': state }
+
+    def get(self, job_id):
+        job = verify_jobs.get(job_id)
+        if job is None:
+            abort(404, 'no such job: %s' % (escape(job_id), ))
+        return jsonify(job.as_dict())
 
     def post(self):
-        if len(request.args.keys()) != 1:
+        arguments = [key for key in request.args.keys() if key != Profiler.argument]
+        if len(arguments) != 1:
             abort(400, 'control endpoint accepts exactly ONE argument')
 
-        action = request.args.keys()[0]
+        action = arguments[0]
 
         if action not in self.arguments:
             abort(400, 'invalid argument: %s' % (escape(action), ))
 
         try:
-            result = getattr(self,'_' + action)()
+            with control_duration.labels(action).time():
+                result = getattr(self,'_' + action)()
         except Exception, err:
             abort(500, 'unable to execute action %s: %s' % (action, str(err)))
         else:
@@ -177,16 +491,21 @@ class NagiosObjectView(MethodView):
     Nagios/Icinga Configurations
     """
 
-    decorators = [Authentify(config['auth'])]
+    decorators = [profiler, admission, authentify]
+
+    # request arguments which control the response instead of filtering objects
+    reserved_arguments = frozenset(['_limit', '_offset', '_fields', '_format', '_effective', '_count', '_group_by', '_dry_run', '_profile', '_pretty'])
 
     def __init__(self, *args, **kwargs):
         MethodView.__init__(self, *args, **kwargs)
-        Model.cfg_file=config['nagios_main_cfg']
-        Model.pynag_directory=config['output_dir']
 
         self.username = request.authorization.username
         self.endpoint = request.path.lstrip('/')
-        self.endpoints = ApiEndpoints()
+        self.endpoints = current_app.endpoints
+
+    def _phase(self, phase):
+        """ times a phase of the request (ex: validate, filter, save) for /metrics """
+        return phase_duration.labels(self.endpoint, phase).time()
 
     def _summary(self, results):
         return {
@@ -195,16 +514,23 @@ class NagiosObjectView(MethodView):
             "total": len(results)
         }
 
-    def _build_query(self, arguments):
+    def _build_query(self, endpoint, arguments):
         """
-        Build query for pynag. Currently supported:
+        Compile the query arguments into a Query. Plain arguments support
+        wildcards:
         - key=*expr
         - key=expr*
         - key=*expr*
         - key=expr
+        Every other condition is written as key__operator=value, see Query
+        for the operators (ex: hostgroups__has_field=web, host_name__in=a,b)
         """
-        query = {}
+        conditions = {}
         for key, value in arguments.iteritems():
+            if Query.split(key)[1] is not None or not isinstance(value, basestring):
+                conditions[key] = value
+                continue
+
             if value.startswith('*') and value.endswith('*'):
                 query_type = '__contains'
             elif value.startswith('*'):
@@ -214,71 +540,250 @@ class NagiosObjectView(MethodView):
             else:
                 query_type = ''
 
-            query[key + query_type] = value.strip('*')
+            conditions[key + query_type] = value.strip('*')
 
-        return query
+        try:
+            query = Query(conditions)
+        except ValueError, err:
+            abort(400, escape(str(err)))
 
-    def get(self):
-        validate = self.endpoints.validate(self.endpoint, request.args)
+        validate = self.endpoints.validate(endpoint, dict.fromkeys(query.attributes, ''))
         if not validate.has_key(200):
             abort(*validate.items()[0])
-        endpoint_objects = getattr(Model, self.endpoint.capitalize()).objects
+        return query
 
-        query = self._build_query(request.args)
+    def _query_arguments(self):
+        """ request arguments without the reserved control arguments """
+        return dict([(key, value) for key, value in request.args.iteritems() if key not in self.reserved_arguments])
 
-        try:
-            result = [ obj['meta']['defined_attributes'] for obj in endpoint_objects.filter(**query)]
-        except IOError, err:
-            abort(500, "error opening config files: %s" % (str(err), ))
-        except:
-            abort(500)
+    def _serialize(self, objects, ndjson=False, indent=None):
+        """
+        Lazily serialize objects into chunks of either a JSON array (same
+        format as dumps() of the whole list) or newline delimited JSON.
+        """
+        if ndjson:
+            for obj in objects:
+                yield dumps(obj) + '\n'
+            return
+
+        separator = '['
+        for obj in objects:
+            if indent:
+                yield separator + '\n  ' + dumps(obj, indent=indent).replace('\n', '\n  ')
+            else:
+                yield separator + dumps(obj)
+            separator = ', '
+
+        if separator == '[':
+            yield '[]'
         else:
-            return Response(dumps(result, indent=None if request.is_xhr else 2), mimetype='application/json')
+            yield '\n]' if indent else ']'
 
-    def delete(self):
-        validate = self.endpoints.validate(self.endpoint, request.args)
-        if not validate.has_key(200):
-            abort(*validate.items()[0])
-        endpoint_objects = getattr(Model, self.endpoint.capitalize()).objects
+    def _etag(self, *representation):
+        """
+        ETag of a GET response: the configuration state, the endpoint, the
+        normalized query and the negotiated representation
+        """
+        arguments = sorted([(key, sorted(values)) for key, values in request.args.iterlists()])
+        return sha1(repr((index.fingerprint(), self.endpoint, arguments, representation))).hexdigest()
+
+    def get(self):
+        with self._phase('validate'):
+            query = self._build_query(self.endpoint, self._query_arguments())
+
+            offset = number_argument('_offset', 0)
+            limit = number_argument('_limit') if '_limit' in request.args else None
+            effective = number_argument('_effective', 0)
+            count = number_argument('_count', 0)
+            group_by = request.args.get('_group_by')
+            if group_by is not None:
+                validate = self.endpoints.validate(self.endpoint, {group_by: ''})
+                if not validate.has_key(200):
+                    abort(*validate.items()[0])
+
+            fields = [field.strip() for field in request.args.get('_fields', '').split(',') if field.strip()]
+            validate = self.endpoints.validate(self.endpoint, dict.fromkeys(fields, ''))
+            if not validate.has_key(200):
+                abort(*validate.items()[0])
 
-        query = self._build_query(request.args)
+        fmt, indent, encoding = negotiate()
 
+        # answer conditional requests from the file stamps, without parsing anything
         try:
-            objects = endpoint_objects.filter(**query)
+            with self._phase('etag'):
+                etag = self._etag(fmt, indent, encoding)
+        except (IOError, OSError), err:
+            abort(500, "error opening config files: %s" % (str(err), ))
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        if count or group_by is not None:
+            try:
+                with self._phase('filter'):
+                    response = jsonify(index.count(self.endpoint, query, group_by))
+            except IOError, err:
+                abort(500, "error opening config files: %s" % (str(err), ))
+            except:
+                abort(500)
+            response.set_etag(etag)
+            return response
+
+        try:
+            with self._phase('filter'):
+                objects = index.iterfilter(self.endpoint, query)
         except IOError, err:
             abort(500, "error opening config files: %s" % (str(err), ))
         except:
             abort(500)
 
-        unique_key = self.endpoints.get_unique_key(self.endpoint)
-        results = []
-        for obj in objects:
-            try:
-                obj.delete()
-            except Exception, err:
-                results.append({ 500: "unable to delete %s object %s: %s" % (self.endpoint, obj[unique_key], str(err)) })
-                logging.debug("[audit] [user: %s] failed to delete %s object %s: %s" % (self.username, self.endpoint, obj[unique_key], str(err)))
-            else:
-                results.append({ 200: "successfully deleted %s object: %s" % (self.endpoint, obj[unique_key]) })
-                logging.info("[audit] [user: %s] deleted %s object: %s" % (self.username, self.endpoint, obj[unique_key]))
+        objects = islice(objects, offset, None if limit is None else offset + limit)
+        if fmt == 'msgpack':
+            # the array header needs the number of objects up front
+            objects = list(objects)
+            total = len(objects)
+        if effective:
+            objects = (index.effective(item) for item in objects)
+        if fields:
+            result = (dict([(field, item[field]) for field in fields if field in item]) for item in objects)
+        elif effective:
+            result = objects
+        else:
+            result = (item['meta']['defined_attributes'] for item in objects)
+
+        # objects are matched, serialized and compressed while the response is streamed
+        if fmt == 'msgpack':
+            chunks = pack_msgpack(result, total)
+        else:
+            chunks = self._serialize(result, ndjson=fmt == 'ndjson', indent=indent)
+        response = streamed_response(chunks, fmt, encoding, phase_duration.labels(self.endpoint, 'serialize'))
+        response.set_etag(etag)
+        return response
+
+    def delete(self):
+        with self._phase('validate'):
+            query = self._build_query(self.endpoint, self._query_arguments())
+            dry_run = number_argument('_dry_run', 0)
+        writer = ConfigWriter(index, config['output_dir'])
+        diffs = [] if dry_run else None
+
+        with index.writing():
+            with self._phase('filter'):
+                refresh_index()
+
+                # group the deletes by file, every file is rewritten only once
+                objects, targets = self._plan_delete(writer, self.endpoint, query, diffs)
+
+            with self._phase('delete'):
+                if dry_run:
+                    files = writer.preview()
+                    errors = dict([(filename, diff if isinstance(diff, Exception) else None) for filename, diff in files.iteritems()])
+                else:
+                    errors = writer.commit()
+                    self._record()
+
+        results = self._delete_results(self.endpoint, objects, targets, errors, dry_run)
 
         summary = self._summary(results)
+        if dry_run:
+            return self._preview(results, summary, diffs, files)
+
         logging.warn("[audit] [user: %s] deleted %d %s objects (out of %d requested)" % (
             self.username, summary['succeeded'], 
             self.endpoint, summary['total'])
         )
         return jsonify(results=results, summary=summary)
 
+    def _preview(self, results, summary, objects, files):
+        """ response of a dry run: the results along with the changes of every object and file """
+        return jsonify(
+            results=results,
+            summary=summary,
+            dry_run=True,
+            objects=objects,
+            files=dict([(filename, diff) for filename, diff in files.iteritems() if not isinstance(diff, Exception)])
+        )
+
+    def _record(self):
+        """ pick up the written files right away, so their changes are logged with the user """
+        try:
+            index.refresh(self.username)
+        except Exception, err:
+            logging.warn("unable to refresh the object index: %s" % (str(err), ))
+
+    def _pending(self):
+        """
+        changes queued by earlier operations of the same request, by id of
+        the item: created (name -> (filename, attributes)), removed and
+        updated items (with their new attributes)
+        """
+        return {'created': {}, 'removed': {}, 'updated': {}}
+
+    def _plan_delete(self, writer, endpoint, query, diffs=None, pending=None):
+        """
+        queue the removal of all matching objects, returns the objects and
+        their files. If diffs is a list, the removed objects are added to it.
+        With pending, the objects are matched against the state left by the
+        earlier operations: removed objects are gone, updated ones match
+        with their new attributes and created ones are dropped again
+        """
+        objects = index.filter(endpoint, query, refresh=False)
+        if pending is None:
+            targets = [writer.remove(obj) for obj in objects]
+        else:
+            objects = [obj for obj in objects if id(obj) not in pending['removed'] and id(obj) not in pending['updated']]
+            objects += [obj for obj, attributes in pending['updated'].values() if query.match(index.resolved(attributes))]
+            targets = [writer.remove(obj) for obj in objects]
+            for obj in objects:
+                pending['updated'].pop(id(obj), None)
+                pending['removed'][id(obj)] = obj
+
+            for name, (filename, attributes) in pending['created'].items():
+                # not written yet, matched like the definition which would be written
+                defined = dict([(key, unicode(value)) for key, value in attributes.iteritems() if value is not None])
+                if query.match(index.resolved(dict(defined, meta={'object_type': endpoint, 'defined_attributes': defined}))):
+                    writer.discard(filename, attributes)
+                    del pending['created'][name]
+                    objects.append(attributes)
+                    targets.append(filename)
+
+        if diffs is not None:
+            unique_key = self.endpoints.get_unique_key(endpoint)
+            diffs += [
+                {'action': 'delete', 'endpoint': endpoint, 'name': obj.get(unique_key), 'attributes': obj['meta']['defined_attributes']}
+                for obj in objects
+            ]
+        return objects, targets
+
+    def _delete_results(self, endpoint, objects, targets, errors, dry_run=False):
+        unique_key = self.endpoints.get_unique_key(endpoint)
+        results = []
+        for obj, filename in zip(objects, targets):
+            name = obj.get(unique_key)
+            if isinstance(filename, dict):
+                results.append(filename)
+            elif errors.get(filename) is not None:
+                results.append({ 500: "unable to delete %s object %s: %s" % (endpoint, name, str(errors[filename])) })
+                logging.debug("[audit] [user: %s] failed to delete %s object %s: %s" % (self.username, endpoint, name, str(errors[filename])))
+            elif dry_run:
+                results.append({ 200: "would delete %s object: %s" % (endpoint, name) })
+            else:
+                results.append({ 200: "successfully deleted %s object: %s" % (endpoint, name) })
+                logging.info("[audit] [user: %s] deleted %s object: %s" % (self.username, endpoint, name))
+        return results
+
     def post(self):
         data = request.json
 
         if data is None:
             return jsonify(message='no json received. you need to set your content-type to application/json.')
 
-        if type(data) == list:
-            results = map(self._save_or_update, data)
-        else:
-            results = [self._save_or_update(data)]
+        items = data if type(data) == list else [data]
+        if number_argument('_dry_run', 0):
+            return self._save_or_update(items, dry_run=True)
+
+        results = self._save_or_update(items)
 
         summary = self._summary(results)
         logging.warn("[audit] [user: %s] stored %d %s objects (out of %d requested)" % (
@@ -289,40 +794,344 @@ class NagiosObjectView(MethodView):
         )
         return jsonify(results=results, summary=summary)
 
-    def _save_or_update(self, item):
-            # does this object already exist
-            unique_key = self.endpoints.get_unique_key(self.endpoint)
-            if unique_key in item.keys():
-                query = { unique_key: item[unique_key] }
-                try:
-                    endpoint_object = getattr(Model, self.endpoint.capitalize()).objects.filter(**query)
-                except IOError, err:
-                    abort(500, "error opening config files: %s" % (str(err), ))
-                except:
-                    abort(500)
-
-                if endpoint_object:
-                    endpoint_object = endpoint_object[0]
+    def _save_or_update(self, items, dry_run=False):
+        """
+        Store a list of objects. All unique keys are resolved in a single
+        index pass, the changes are grouped by their target file and every
+        file is written only once. A dry run only computes the changes and
+        returns the preview response.
+        """
+        writer = ConfigWriter(index, config['output_dir'])
+        diffs = [] if dry_run else None
+
+        with index.writing():
+            with self._phase('validate'):
+                refresh_index()
+
+                planned = self._plan_save(writer, self.endpoint, items, diffs=diffs)
+
+            with self._phase('save'):
+                if dry_run:
+                    files = writer.preview()
+                    errors = dict([(filename, diff if isinstance(diff, Exception) else None) for filename, diff in files.iteritems()])
                 else:
-                    endpoint_object = getattr(Model, self.endpoint.capitalize())()
-            else:
-                return { 500: 'required key for %s object not set: %s' % (self.endpoint, unique_key) }
+                    errors = writer.commit()
+                    self._record()
+
+        results = self._save_results(self.endpoint, items, planned, errors, dry_run)
+        if dry_run:
+            return self._preview(results, self._summary(results), diffs, files)
+        return results
+
+    def _plan_save(self, writer, endpoint, items, pending=None, mode=None, diffs=None):
+        """
+        Queue a list of objects in writer. Returns a list with one entry per
+        item: either its result (if it is already known) or the file the
+        change has been queued for.
 
-            validate = self.endpoints.validate(self.endpoint, item)
+        @pending: changes of earlier operations in the same set of changes (see _pending)
+        @mode: "create" or "update" to only allow new or existing objects
+        @diffs: if set to a list, the changes of every object are added to it
+        """
+        unique_key = self.endpoints.get_unique_key(endpoint)
+        pending = self._pending() if pending is None else pending
+        created = pending['created']
+        planned = [None] * len(items)
+
+        # does this object already exist, objects removed earlier in the same set of changes do not
+        existing = index.lookup(endpoint, unique_key, [item[unique_key] for item in items if unique_key in item], refresh=False)
+        existing = dict([(name, obj) for name, obj in existing.iteritems() if id(obj) not in pending['removed']])
+
+        for position, item in enumerate(items):
+            if unique_key not in item.keys():
+                planned[position] = { 500: 'required key for %s object not set: %s' % (endpoint, unique_key) }
+                continue
+
+            validate = self.endpoints.validate(endpoint, item)
             if not validate.has_key(200):
-                return validate
+                planned[position] = validate
+                continue
+
+            name = item[unique_key]
+            exists = name in created or name in existing
+            if mode == 'create' and exists:
+                planned[position] = { 409: '%s object already exists: %s' % (endpoint, name) }
+            elif mode == 'update' and not exists:
+                planned[position] = { 404: '%s object not found: %s' % (endpoint, name) }
+            elif name in created:
+                # created earlier in this request, merge into the pending definition
+                created[name][1].update(item)
+                planned[position] = created[name][0]
+            elif name in existing:
+                endpoint_object = existing[name]
+                current = pending['updated'].get(id(endpoint_object), (endpoint_object, endpoint_object))[1]
+                changes = dict([(key, value) for key, value in item.iteritems() if current.get(key) != value])
+                if changes:
+                    planned[position] = writer.update(endpoint_object, changes)
+                    attributes = dict(current)
+                    attributes.update(changes)
+                    pending['updated'][id(endpoint_object)] = (endpoint_object, attributes)
+                    if diffs is not None:
+                        diffs.append({'action': 'update', 'endpoint': endpoint, 'name': name, 'attributes': dict([
+                            (key, {'old': endpoint_object.get(key), 'new': value}) for key, value in changes.iteritems()
+                        ])})
+                else:
+                    planned[position] = { 200: "successfully stored %s object: %s" % (endpoint, name) }
+            else:
+                attributes = dict(item)
+                created[name] = (writer.add(endpoint, attributes), attributes)
+                planned[position] = created[name][0]
+                if diffs is not None:
+                    diffs.append({'action': 'create', 'endpoint': endpoint, 'name': name, 'attributes': attributes})
+
+        return planned
+
+    def _save_results(self, endpoint, items, planned, errors, dry_run=False):
+        unique_key = self.endpoints.get_unique_key(endpoint)
+        results = []
+        for item, filename in zip(items, planned):
+            if isinstance(filename, dict):
+                results.append(filename)
+                continue
+
+            name = item[unique_key]
+            if errors.get(filename) is not None:
+                logging.debug("[audit] [user: %s] failed to store %s object %s: %s" % (self.username, endpoint, name, str(errors[filename])))
+                results.append({ 500: 'unable to save %s object %s: %s' % (endpoint, name, str(errors[filename])) })
+            elif dry_run:
+                results.append({ 200: "would store %s object: %s" % (endpoint, name) })
+            else:
+                logging.info("[audit] [user: %s] stored %s object %s" % (self.username, endpoint, name))
+                results.append({ 200: "successfully stored %s object: %s" % (endpoint, name) })
+        return results
+
+
+class NagiosBatchView(NagiosObjectView):
+    """
+    NagiosBatchView: applies a list of create/update/save/delete operations
+    across all endpoints as one transaction. All operations share one index
+    pass, every touched file is written once and if any operation fails (or
+    the optional verify with ?verify does), all files are rolled back.
+    Operations are planned in order, every one against the objects as the
+    operations before it leave them.
+
+    example:
+    ========
+
+    [
+        { "op": "create", "endpoint": "host", "data": { "host_name": "web01", ... } },
+        { "op": "save", "endpoint": "service", "data": [ { ... }, { ... } ] },
+        { "op": "delete", "endpoint": "service", "query": { "host_name": "web02" } }
+    ]
+
+    """
 
+    operations = ['create', 'update', 'save', 'delete']
+
+    def _check(self, operation):
+        """ validate an operation, returns the compiled query of delete operations """
+        if not isinstance(operation, dict):
+            abort(400, 'batch operations have to be objects')
+        if operation.get('op') not in self.operations:
+            abort(400, 'invalid batch operation: %s' % (escape(unicode(operation.get('op'))), ))
+        if operation.get('endpoint') not in self.endpoints:
+            abort(400, 'invalid endpoint: %s' % (escape(unicode(operation.get('endpoint'))), ))
+
+        if operation['op'] == 'delete':
+            query = operation.get('query')
+            if not isinstance(query, dict) or not query:
+                abort(400, 'delete operations need a non-empty query')
+            return self._build_query(operation['endpoint'], dict([
+                (key, [unicode(v) if isinstance(v, (int, long, float)) else v for v in value] if isinstance(value, list) else unicode(value))
+                for key, value in query.iteritems()
+            ]))
+
+        data = operation.get('data')
+        items = data if isinstance(data, list) else [data]
+        if not items or not all([isinstance(item, dict) for item in items]):
+            abort(400, '%s operations need an object or a list of objects as data' % (operation['op'], ))
+        unique_key = self.endpoints.get_unique_key(operation['endpoint'])
+        for item in items:
             for key, value in item.iteritems():
-                endpoint_object.set_attribute(key, value)
+                if value is not None and not isinstance(value, (basestring, int, long, float)):
+                    abort(400, 'invalid value for %s: attributes have to be strings or numbers' % (escape(key), ))
+            if unique_key in item and not isinstance(item[unique_key], basestring):
+                abort(400, 'invalid value for %s: has to be a string' % (unique_key, ))
 
+    def post(self):
+        operations = request.json
+
+        if operations is None:
+            return jsonify(message='no json received. you need to set your content-type to application/json.')
+        if not isinstance(operations, list):
+            abort(400, 'batch endpoint expects a list of operations')
+
+        with self._phase('validate'):
+            queries = [self._check(operation) for operation in operations]
+
+        writer = ConfigWriter(index, config['output_dir'])
+        pending = {}
+        planned = []
+        verify = None
+
+        with index.writing():
+            with self._phase('validate'):
+                refresh_index()
+
+                for operation, query in zip(operations, queries):
+                    endpoint = operation['endpoint']
+                    # every operation is planned against the state left by the ones before it
+                    if operation['op'] == 'delete':
+                        planned.append(self._plan_delete(writer, endpoint, query, pending=pending.setdefault(endpoint, self._pending())))
+                    else:
+                        items = operation['data'] if isinstance(operation['data'], list) else [operation['data']]
+                        mode = None if operation['op'] == 'save' else operation['op']
+                        planned.append((items, self._plan_save(writer, endpoint, items, pending.setdefault(endpoint, self._pending()), mode)))
+
+            failed = [
+                result for items, entries in planned for result in entries
+                if isinstance(result, dict) and not result.has_key(200)
+            ]
+            if failed:
+                errors = {}
+                message = '%d operations failed, nothing has been written' % (len(failed), )
+            else:
+                with self._phase('save'):
+                    errors = writer.commit(atomic=True)
+                message = None
+                if any(errors.values()):
+                    message = 'unable to write configuration, nothing has been written: %s' % (
+                        '; '.join([str(err) for err in errors.values() if err]), )
+
+            self._record()
+
+        # verify without holding the index, other requests (and writers) go on meanwhile
+        if message is None and 'verify' in request.args:
             try:
-                endpoint_object.save()
+                verify = verify_config()
             except Exception, err:
-                logging.debug("[audit] [user: %s] failed to store %s object %s: %s" % (self.username, self.endpoint, item[unique_key], str(err)))
-                return { 500: 'unable to save %s object %s: %s' % (self.endpoint, item[unique_key], str(err)) }
+                verify = {'output': str(err), 'returncode': 255}
+            if verify['returncode'] != 0:
+                with index.writing():
+                    conflicts = writer.rollback()
+                    self._record()
+                message = 'configuration did not verify, all changes have been rolled back'
+                if conflicts:
+                    message = 'configuration did not verify, changes have been rolled back except in files changed since: %s' % (
+                        ', '.join(conflicts), )
+
+        committed = message is None
+        results = []
+        for operation, (items, entries) in zip(operations, planned):
+            if not committed:
+                entries = [
+                    entry if isinstance(entry, dict) and not entry.has_key(200) else { 409: message }
+                    for entry in entries
+                ]
+                errors = {}
+            if operation['op'] == 'delete':
+                operation_results = self._delete_results(operation['endpoint'], items, entries, errors)
+            else:
+                operation_results = self._save_results(operation['endpoint'], items, entries, errors)
+            results.append({'op': operation['op'], 'endpoint': operation['endpoint'], 'results': operation_results})
+
+        summary = self._summary([result for operation in results for result in operation['results']])
+        logging.warn("[audit] [user: %s] batch of %d operations %s, %d objects changed (out of %d requested)" % (
+            self.username,
+            len(operations),
+            'committed' if committed else 'rolled back',
+            summary['succeeded'],
+            summary['total'])
+        )
+        return jsonify(results=results, summary=summary, committed=committed, message=message, verify=verify)
+
+class NagiosChangesView(MethodView):
+    """
+    NagiosChangesView: '/changes' endpoint, returns the objects which have
+    been created, updated or deleted after a sequence number (?since=<seq>).
+    If there are no changes yet, ?wait=<seconds> waits for them (long
+    polling). If "truncated" is set, changes have been dropped from the log
+    and the client has to read the objects again.
+    """
+
+    decorators = [authentify]
+
+    def get(self):
+        since = number_argument('since', 0)
+        wait = min(number_argument('wait', 0, float), config['changes']['timeout'])
+        endpoint = request.args.get('endpoint')
+        if endpoint is not None and endpoint not in current_app.endpoints:
+            abort(404, 'no such endpoint: %s' % (escape(endpoint), ))
+
+        # changes made outside of the api are only noticed by a refresh of the index
+        step = max(index.interval, 1)
+        first = since
+        deadline = time.time() + wait
+        while True:
+            refresh_index()
+
+            remaining = deadline - time.time()
+            entries, last, truncated = changes.since(since, max(0, min(step, remaining)))
+            if endpoint is not None:
+                entries = [entry for entry in entries if entry['endpoint'] == endpoint]
+            if entries or truncated or remaining <= step:
+                break
+            since = last
+
+        return jsonify(since=first, last=last, truncated=truncated, changes=entries)
+
+
+class NagiosProfilesView(MethodView):
+    """
+    NagiosProfilesView: '/profiles' endpoint, lists the kept profiles of
+    requested (?_profile=1) and slow requests. '/profiles/<id>' returns
+    one of them with the "limit" most expensive functions sorted by
+    "sort" (default: cumulative), ?format=pstats returns the raw
+    statistics for pstats or snakeviz
+    """
+
+    decorators = [authentify]
+
+    def get(self, profile_id=None):
+        if not profiler.allowed(request.authorization.username):
+            abort(403, 'profiling is not enabled for this user')
+
+        if profile_id is None:
+            return jsonify(profiles=[profile.as_dict() for profile in profiles.list()])
+
+        profile = profiles.get(profile_id)
+        if profile is None:
+            abort(404, 'no such profile: %s' % (escape(profile_id), ))
+
+        if request.args.get('format') == 'pstats':
+            response = Response(profile.dump(), mimetype='application/octet-stream')
+            response.headers['Content-Disposition'] = 'attachment; filename=%s.prof' % (profile.id, )
+            return response
+
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            abort(400, 'invalid sort key: %s' % (escape(sort), ))
+        try:
+            limit = int(request.args.get('limit', 50))
+        except ValueError:
+            abort(400, 'invalid value for limit: %s' % (escape(request.args.get('limit')), ))
+
+        result = profile.as_dict()
+        result['report'] = profile.report(sort, limit)
+        return jsonify(result)
+
+
+class NagiosMetricsView(MethodView):
+    """
+    NagiosMetricsView: '/metrics' endpoint, returns the request latencies
+    and counters of this process in the prometheus text format
+    """
+
+    decorators = [authentify]
+
+    def get(self):
+        return Response(registry.render(), content_type=registry.content_type)
 
-            logging.info("[audit] [user: %s] stored %s object %s" % (self.username, self.endpoint, item[unique_key]))
-            return { 200: "successfully stored %s object: %s" % (self.endpoint, item[unique_key]) }
 
 class NagiosAPI(Flask):
     """
@@ -337,11 +1146,18 @@ class NagiosAPI(Flask):
         logging.config.dictConfig(config['logging'])
 
         self.request_class = CustomRequestClass
-        self.endpoints = ApiEndpoints()
+        self.endpoints = ApiEndpoints(config['schema_cache'])
+
+        if config['index']['lock_file'] and not config['changes']['file']:
+            logging.warn("index.lock_file is set but changes.file is not, every process keeps its own /changes log")
+
+        if config['index']['preload']:
+            index.refresh()
 
         self.__register_endpoints()
         self.__register_error_handler()
         self.__register_help_handler()
+        self.__register_metrics_handler()
 
     def __error_handler(self, err):
         if not isinstance(err, HTTPException):
@@ -356,14 +1172,38 @@ class NagiosAPI(Flask):
 
         if err.code == 401:
             response.headers['WWW-Authenticate'] = 'Basic realm="Login Required"'
+        if getattr(err, 'retry_after', None):
+            response.headers['Retry-After'] = str(err.retry_after)
 
         return response
 
     def __help(self):
-        if request.content_type=='application/json':
-            return jsonify(endpoints=self.endpoints)
+        formats = ['json', 'msgpack']
+        if request.content_type=='application/json' or request.accept_mimetypes.best in (
+                response_formats['json'], response_formats['msgpack'], 'application/msgpack'):
+            fmt, indent, encoding = negotiate(formats)
+            if fmt == 'msgpack':
+                chunks = pack_msgpack([{'endpoints': self.endpoints.help}])
+            else:
+                chunks = [dumps({'endpoints': self.endpoints.help}, indent=indent)]
+            return streamed_response(chunks, fmt, encoding)
         else:
-            return render_template('help.html', endpoints=self.endpoints)
+            return render_template('help.html', endpoints=self.endpoints.help)
+
+    def __start_request(self):
+        g.start = timer()
+
+    def __finish_request(self, response):
+        """ observe the duration once the response has been sent, streamed responses included """
+        start = getattr(g, 'start', None)
+        if start is not None:
+            histogram = request_duration.labels(request.endpoint or 'none', request.method, response.status_code)
+            response.call_on_close(lambda: histogram.observe(timer() - start))
+        return response
+
+    def __register_metrics_handler(self):
+        self.before_request(self.__start_request)
+        self.after_request(self.__finish_request)
 
     def __register_help_handler(self):
         for endpoint, name in [('/', 'index'), ('/help', 'help')]:
@@ -376,10 +1216,18 @@ class NagiosAPI(Flask):
     def __register_endpoints(self):
         for endpoint in self.endpoints.keys():
             self.add_url_rule('/' + endpoint, view_func=NagiosObjectView.as_view(endpoint))
-        self.add_url_rule('/control', view_func=NagiosControlView.as_view('control'))
+        control_view = NagiosControlView.as_view('control')
+        self.add_url_rule('/control', view_func=control_view, methods=['POST'])
+        self.add_url_rule('/control/jobs/<job_id>', view_func=control_view, methods=['GET'])
+        self.add_url_rule('/batch', view_func=NagiosBatchView.as_view('batch'), methods=['POST'])
+        self.add_url_rule('/changes', view_func=NagiosChangesView.as_view('changes'), methods=['GET'])
+        self.add_url_rule('/metrics', view_func=NagiosMetricsView.as_view('metrics'), methods=['GET'])
+        profiles_view = NagiosProfilesView.as_view('profiles')
+        self.add_url_rule('/profiles', view_func=profiles_view, methods=['GET'])
+        self.add_url_rule('/profiles/<profile_id>', view_func=profiles_view, methods=['GET'])
 
 
 if __name__ == '__main__':
     app = NagiosAPI(__name__)
     logging.info(" * starting restlos V%s" % (VERSION, ))
-    app.run(host=config['host'], port=config['port'])
+    app.run(host=config['host'], port=config['port'], threaded=True)
@@ -2,3 +2,14 @@
 # -*- coding: UTF-8 -*-
 
 from utils import *
+from query import *
+from metrics import *
+from locking import *
+from index import *
+from writer import *
+from jobs import *
+from changes import *
+from profiling import *
+from encoding import *
+from lazy import *
+from admission import *
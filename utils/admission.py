@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import math
+import threading
+
+from timeit import default_timer as timer
+from flask import current_app
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+
+from metrics import registry
+
+__all__ = ['CostClass', 'AdmissionControl']
+
+admission_total = registry.counter(
+    'restlos_admission_total',
+    'requests by cost class and admission result (admitted, queued, rejected, timeout)',
+    ['class', 'result']
+)
+admission_wait = registry.histogram(
+    'restlos_admission_wait_seconds',
+    'time admitted requests waited for a slot of their cost class',
+    ['class']
+)
+
+class CostClass(object):
+    """
+    CostClass: limits the number of requests of one cost class which are
+    handled at the same time. Requests beyond the limit wait for a free
+    slot in order of arrival. A request is rejected right away if "queue"
+    requests are already waiting and after "timeout" seconds of waiting.
+
+    @name: name of the class (ex: read, bulk)
+    @limit: number of concurrent requests, 0 is unlimited
+    @queue: number of requests which may wait for a slot
+    @timeout: maximum seconds a request waits for a slot
+    """
+
+    def __init__(self, name, limit=0, queue=0, timeout=0):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.condition = threading.Condition(threading.Lock())
+        self.active = 0
+        self.waiting = 0
+        # moving average of the seconds a slot is held, for Retry-After
+        self.average = None
+
+    def acquire(self):
+        """ take a slot, returns the result: admitted, queued (and admitted), rejected or timeout """
+        with self.condition:
+            if not self.limit or (self.active < self.limit and not self.waiting):
+                self.active += 1
+                return 'admitted'
+            if self.waiting >= self.queue:
+                return 'rejected'
+
+            self.waiting += 1
+            deadline = timer() + self.timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - timer()
+                    if remaining <= 0:
+                        return 'timeout'
+                    self.condition.wait(remaining)
+                self.active += 1
+                return 'queued'
+            finally:
+                self.waiting -= 1
+
+    def release(self, duration):
+        with self.condition:
+            self.active -= 1
+            self.average = duration if self.average is None else 0.8 * self.average + 0.2 * duration
+            self.condition.notify()
+
+    def retry_after(self):
+        """ seconds until the waiting requests are likely done, at least 1 """
+        with self.condition:
+            average, waiting = self.average or 1.0, self.waiting
+        return max(1, int(math.ceil(average * (waiting + 1) / max(self.limit, 1))))
+
+
+class AdmissionControl(object):
+    """
+    AdmissionControl: Class decorator for flask views, every request takes
+    a slot of its cost class before the view is called and gives it back
+    once its response has been sent, streamed responses included. If the
+    class is saturated, the request is answered with 429 (queue full) or
+    503 (timed out waiting) and a Retry-After header instead. Has to be
+    applied after Authentify, unauthenticated requests never take a slot.
+    The limits apply per process.
+
+    @config: the "admission" section of the configuration
+    @classify: function returning the cost class of the current request
+
+    example:
+    ========
+
+    {
+        "enabled": true,
+        "bulk_size": 100,
+        "classes": {
+            "read": { "limit": 0 },
+            "scan": { "limit": 8, "queue": 16, "timeout": 10 },
+            "write": { "limit": 4, "queue": 16, "timeout": 30 },
+            "bulk": { "limit": 1, "queue": 4, "timeout": 30 },
+            "control": { "limit": 1, "queue": 8, "timeout": 60 }
+        }
+    }
+
+    """
+
+    def __init__(self, config, classify):
+        self.enabled = config.get('enabled', True)
+        self.classify = classify
+        self.classes = dict([
+            (name, CostClass(name, **settings)) for name, settings in config.get('classes', {}).iteritems()
+        ])
+
+    def _reject(self, cost_class, result):
+        if result == 'rejected':
+            err = TooManyRequests('too many %s requests, try again later' % (cost_class.name, ))
+        else:
+            err = ServiceUnavailable('timed out waiting for a slot for %s requests, try again later' % (cost_class.name, ))
+        err.retry_after = cost_class.retry_after()
+        raise err
+
+    def __call__(self, f):
+        def wrapped_function(*args, **kwargs):
+            cost_class = self.classes.get(self.classify()) if self.enabled else None
+            if cost_class is None:
+                return f(*args, **kwargs)
+
+            start = timer()
+            result = cost_class.acquire()
+            admission_total.labels(cost_class.name, result).inc()
+            if result not in ('admitted', 'queued'):
+                self._reject(cost_class, result)
+
+            admitted = timer()
+            admission_wait.labels(cost_class.name).observe(admitted - start)
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            except:
+                cost_class.release(timer() - admitted)
+                raise
+
+            response.call_on_close(lambda: cost_class.release(timer() - admitted))
+            return response
+
+        return wrapped_function
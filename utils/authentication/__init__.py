@@ -1,20 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import os
+import hmac
+import importlib
+import time
 import logging
+import threading
 
 from hashlib import sha256
+from collections import OrderedDict
+from timeit import default_timer as timer
 from flask import request, abort
 
-__all__ = ['AuthDict', 'Authentify']
+from ..metrics import registry
 
-# is the ldap module available
-try:
-    from ldapauth import AuthLDAP
-except ImportError:
-    pass
-else:
-    __all__.append('AuthLDAP')
+__all__ = ['AuthDict', 'Authentify', 'CredentialCache']
+
+# providers in modules of their own, only imported when they are configured (ex: ldap)
+provider_modules = {
+    'AuthLDAP': 'ldapauth',
+}
+
+auth_duration = registry.histogram(
+    'restlos_auth_duration_seconds',
+    'time spent authenticating requests (result: success, failure or cached)',
+    ['provider', 'result']
+)
+cache_total = registry.counter(
+    'restlos_auth_cache_total',
+    'lookups of the credential cache (result: hit or miss)',
+    ['result']
+)
 
 class AuthDict(object):
     """
@@ -29,6 +46,58 @@ class AuthDict(object):
         return username in self.credentials.keys() and self.credentials[username] == sha256(password).hexdigest()
 
 
+class CredentialCache(object):
+    """
+    CredentialCache: remembers successful verifications of username/password
+    pairs for a limited time, so the authentication provider does not have
+    to be asked on every request. Passwords are only stored as a keyed hash
+    with a random, per process key.
+
+    @ttl: seconds a verification stays valid
+    @size: maximum number of cached verifications (least recently used are dropped)
+    """
+
+    def __init__(self, ttl=300, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.key = os.urandom(32)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password):
+        message = u"%s\0%s" % (username, password)
+        return hmac.new(self.key, message.encode('utf-8'), sha256).digest()
+
+    def get(self, username, password):
+        digest = self._digest(username, password)
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry and entry[1] <= time.time():
+                del self.entries[username]
+            elif entry and entry[0] == digest:
+                # move to the end, so the least recently used entry comes first
+                self.entries[username] = self.entries.pop(username)
+                self.hits += 1
+                cache_total.labels('hit').inc()
+                return True
+            self.misses += 1
+        cache_total.labels('miss').inc()
+        return False
+
+    def add(self, username, password):
+        digest = self._digest(username, password)
+        with self.lock:
+            self.entries.pop(username, None)
+            self.entries[username] = (digest, time.time() + self.ttl)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
 class Authentify(object):
     """
     Authentify: Class decorator for flask views which are only accessible
@@ -47,9 +116,16 @@ class Authentify(object):
             "domain": "EXAMPLE.COM",
             "ssl": "TRUE",
             "groups": [ "admins", "developers" ]
+        },
+        "cache": {
+            "ttl": 300,
+            "size": 1024
         }
     }
 
+    if "cache" is set and its ttl is greater than zero, successful logins
+    are cached for "ttl" seconds (see CredentialCache)
+
     """
 
     def __init__(self, config=None):
@@ -57,18 +133,46 @@ class Authentify(object):
             self.auth = AuthDict()
         else:
             try:
-                self.auth = globals()[config['provider']](**config['params'])
+                self.auth = self._provider(config['provider'])(**config['params'])
             except Exception, err:
                 logging.error("unable to load authentication provider %s (%s)." % (config['provider'], str(err)))
                 logging.error("fallback to default dict authentication provider!")
                 self.auth = AuthDict()
+        self.provider = self.auth.__class__.__name__
+
+        cache = (config or {}).get('cache', {})
+        if cache.get('ttl', 0) > 0:
+            self.cache = CredentialCache(**cache)
+        else:
+            self.cache = None
+
+    @staticmethod
+    def _provider(name):
+        if name in provider_modules:
+            return getattr(importlib.import_module('.' + provider_modules[name], __name__), name)
+        return globals()[name]
+
+    def authenticate(self, username, password):
+        start = timer()
+        if self.cache and self.cache.get(username, password):
+            auth_duration.labels(self.provider, 'cached').observe(timer() - start)
+            return True
+
+        if not self.auth.authenticate(username, password):
+            auth_duration.labels(self.provider, 'failure').observe(timer() - start)
+            return False
+
+        if self.cache:
+            self.cache.add(username, password)
+        auth_duration.labels(self.provider, 'success').observe(timer() - start)
+        return True
 
     def __call__(self, f):
         def wrapped_function(*args, **kwargs):
             credentials = request.authorization
 
             if credentials:
-                if self.auth.authenticate(credentials.username, credentials.password):
+                if self.authenticate(credentials.username, credentials.password):
                     return f(*args, **kwargs)
 
             abort(401)
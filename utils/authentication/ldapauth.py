@@ -2,22 +2,146 @@
 # -*- coding: UTF-8 -*-
 
 import ldap
+import Queue
 import logging
+import threading
+
+from ldap.dn import escape_dn_chars
+from ldap.filter import escape_filter_chars
+
+class LDAPPool(object):
+    """
+    LDAPPool: thread-safe pool of reusable ldap connections. If binddn is
+    set, every connection is bound with these credentials once when it is
+    created (persistent bind). A network error (ex: the server restarted)
+    drops the failed and all idle connections, they are most likely stale
+    as well, and the operation is retried once on a new connection.
+
+    @uri: ldap uri of the server (ex: ldaps://ldap.example.com:636)
+    @size: maximum number of open connections
+    @timeout: network timeout and timeout for waiting on a free connection
+    """
+
+    network_errors = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+    def __init__(self, uri, size=4, timeout=5, binddn=None, bindpw=None):
+        self.uri = uri
+        self.size = size
+        self.timeout = timeout
+        self.binddn = binddn
+        self.bindpw = bindpw
+
+        self.lock = threading.Lock()
+        self.idle = Queue.LifoQueue()
+        self.count = 0
+
+    def _connect(self):
+        connection = ldap.initialize(self.uri)
+        connection.set_option(ldap.OPT_REFERRALS, 0)
+        connection.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+        connection.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        if self.binddn:
+            connection.simple_bind_s(self.binddn, self.bindpw)
+        return connection
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except Queue.Empty:
+            pass
+
+        with self.lock:
+            create = self.count < self.size
+            if create:
+                self.count += 1
+
+        if not create:
+            try:
+                return self.idle.get(timeout=self.timeout)
+            except Queue.Empty:
+                raise ldap.TIMEOUT({'desc': 'no free connection in ldap pool for %s' % (self.uri, )})
+
+        return self._open()
+
+    def _open(self):
+        """ a new connection, its slot in the pool has to be counted already """
+        try:
+            return self._connect()
+        except:
+            with self.lock:
+                self.count -= 1
+            raise
+
+    def release(self, connection):
+        self.idle.put(connection)
+
+    def discard(self, connection):
+        with self.lock:
+            self.count -= 1
+        try:
+            connection.unbind_s()
+        except Exception:
+            pass
+
+    def run(self, operation):
+        """ run operation(connection) on a pooled connection, reconnecting once on network errors """
+        connection = self.acquire()
+        for attempt in range(2):
+            try:
+                result = operation(connection)
+            except self.network_errors, err:
+                self.discard(connection)
+                if attempt:
+                    raise
+                logging.warn("ldap connection to %s failed (%s), reconnecting" % (self.uri, str(err)))
+                # the idle connections are most likely stale as well, retry on a new one
+                self.close()
+                with self.lock:
+                    self.count += 1
+                connection = self._open()
+            except ldap.LDAPError:
+                # the connection itself is still usable (ex: invalid credentials)
+                self.release(connection)
+                raise
+            except:
+                self.discard(connection)
+                raise
+            else:
+                self.release(connection)
+                return result
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except Queue.Empty:
+                break
+
 
 class AuthLDAP(object):
     """
     AuthLDAP: Authenticate a user against a ldap server
+
+    Connections are pooled (pool_size, timeout). If binddn/bindpw of a
+    service account are set, group memberships are searched with this
+    account on a separate pool of persistently bound connections, otherwise
+    the search is done with the credentials of the user.
     """
 
-    def __init__(self, 
-            ldapserver="127.0.0.1", 
+    def __init__(self,
+            ldapserver="127.0.0.1",
             userattr="uid",
             searchattr="",
             groupattr="memberof",
-            basedn="dc=example,dc=com", 
-            searchdn="dc=example,dc=com", 
-            ssl=True, 
-            groups=[]):
+            basedn="dc=example,dc=com",
+            searchdn="dc=example,dc=com",
+            ssl=True,
+            groups=[],
+            port=None,
+            binddn="",
+            bindpw="",
+            pool_size=4,
+            timeout=5):
         self.ldapserver = ldapserver
         self.basedn = basedn
         self.groupattr = groupattr
@@ -31,21 +155,47 @@ class AuthLDAP(object):
         else:
             self.searchattr = searchattr
 
+        self._initialize()
+
+        uri = "%s://%s:%d" % (
+            'ldaps' if self.ssl else 'ldap',
+            self.ldapserver,
+            port or (636 if self.ssl else 389)
+        )
+        self.pool = LDAPPool(uri, size=pool_size, timeout=timeout)
+        if binddn:
+            self.search_pool = LDAPPool(uri, size=pool_size, timeout=timeout, binddn=binddn, bindpw=bindpw)
+        else:
+            self.search_pool = None
+
     def _initialize(self):
+        # global options, they have to be set before any connection is created
         ldap.set_option(ldap.OPT_REFERRALS, 0)
         if self.ssl:
             ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
 
-        self.ldap = ldap.initialize("%s://%s:%d" % (
-            'ldaps' if self.ssl else 'ldap',
-            self.ldapserver,
-            636 if self.ssl else 389
-        ))
+    def _search(self, connection, username):
+        return connection.search_s(
+            self.searchdn,
+            ldap.SCOPE_ONELEVEL,
+            '(%s=%s)' % (self.searchattr, escape_filter_chars(username)),
+            [str(self.groupattr)]
+        )
 
     def authenticate(self, username, password):
-        self._initialize()
+        # an empty password would result in an anonymous bind
+        if not password:
+            return False
+
+        binddn = "%s=%s,%s" % (self.userattr, escape_dn_chars(username), self.basedn)
+
+        def bind_and_search(connection):
+            connection.simple_bind_s(binddn, password)
+            if self.groups and not self.search_pool:
+                return self._search(connection, username)
+
         try:
-            self.ldap.simple_bind_s("%s=%s,%s" % (self.userattr, username, self.basedn), password)
+            result = self.pool.run(bind_and_search)
         except Exception, err:
             logging.warn(str(err))
             return False
@@ -54,7 +204,8 @@ class AuthLDAP(object):
                 return True
 
             try:
-                result = self.ldap.search_s(self.searchdn, ldap.SCOPE_ONELEVEL, '(%s=%s)' % (self.searchattr, username), [str(self.groupattr)])
+                if self.search_pool:
+                    result = self.search_pool.run(lambda connection: self._search(connection, username))
                 if result[0][1][self.groupattr][0] in self.groups:
                     return True
             except:
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import io
+import os
+import time
+import logging
+import tempfile
+import threading
+
+from json import dumps, loads
+from collections import deque
+
+__all__ = ['ChangeLog']
+
+class ChangeLog(object):
+    """
+    ChangeLog: bounded log of changed objects, numbered by a sequence which
+    only ever increases. Readers ask for the changes after the last
+    sequence they have seen and may wait for new ones (long polling).
+
+    With a file, the log is shared by all processes of the api (ex: uwsgi
+    workers) and survives restarts: changes are appended to the file while
+    holding the SharedLock and every process reads the changes of the
+    others from it. The stamps of the changed files are written along with
+    their changes. A change of a file which has already been recorded with
+    the same stamp - by the process which wrote it through the api, or the
+    first one noticing a change made outside of the api - is not logged
+    again by the other processes.
+
+    @size: number of changes kept, older ones are dropped
+    @filename: optional file shared by all processes
+    @shared: SharedLock of all processes, serializes the writers of the file
+    """
+
+    # seconds between two checks of the file for changes of other processes
+    poll = 0.5
+
+    def __init__(self, size=1000, filename=None, shared=None):
+        self.size = size
+        self.filename = filename
+        self.writers = shared if shared is not None else threading.RLock()
+        self.condition = threading.Condition(threading.RLock())
+        self.entries = deque(maxlen=size)
+        self.seq = 0
+
+        # state of the shared file: stamps of the recorded files, read position and lines
+        self.recorded = {}
+        self.fh = None
+        self.inode = None
+        self.partial = ''
+        self.lines = 0
+
+    def append(self, changes, files=None):
+        """
+        add a list of changes (dicts), every change gets its sequence number
+
+        @files: the changed files and their stamps (None if removed), changes
+        of files which are already recorded with this stamp are dropped
+        """
+        if not changes:
+            return
+        if self.filename is None:
+            with self.condition:
+                self._add(changes)
+            return
+
+        with self.writers:
+            with self.condition:
+                self._sync()
+                if files is not None:
+                    files = dict([
+                        (filename, list(stamp) if stamp else None) for filename, stamp in files.iteritems()
+                        if self.recorded.get(filename) != (list(stamp) if stamp else None)
+                    ])
+                    changes = [change for change in changes if change['filename'] in files]
+                    if not changes:
+                        return
+
+                lines = [dumps({'recorded': files or {}})]
+                for position, change in enumerate(changes):
+                    lines.append(dumps(dict(change, seq=self.seq + position + 1)))
+                self._write(lines)
+                self._sync()
+                if self.lines > 2 * self.size:
+                    self._rotate()
+
+    def _add(self, changes):
+        for change in changes:
+            self.seq += 1
+            change['seq'] = self.seq
+            self.entries.append(change)
+        self.condition.notify_all()
+
+    def _write(self, lines):
+        # a single write while holding the lock, readers never see lines of two writers mixed
+        with io.open(self.filename, 'ab') as fh:
+            fh.write(''.join([line + '\n' for line in lines]))
+
+    def _rotate(self):
+        """ replace the file by the kept changes, preceded by the stamps of all recorded files """
+        fd, filename = tempfile.mkstemp(prefix='.changes-', dir=os.path.dirname(os.path.abspath(self.filename)))
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(dumps({'recorded': self.recorded}) + '\n')
+                fh.write(''.join([dumps(change) + '\n' for change in self.entries]))
+            os.rename(filename, self.filename)
+        except Exception, err:
+            logging.warn("unable to rotate change log %s: %s" % (self.filename, str(err)))
+            if os.path.exists(filename):
+                os.unlink(filename)
+        else:
+            self._sync()
+
+    def _sync(self):
+        """ read what has been appended to the file since, the whole file again after a rotation """
+        if self.filename is None:
+            return
+        try:
+            inode = os.stat(self.filename).st_ino
+        except OSError:
+            return
+        if inode != self.inode:
+            if self.fh is not None:
+                self.fh.close()
+            self.fh = io.open(self.filename, 'rb')
+            self.inode = inode
+            self.partial = ''
+            self.lines = 0
+
+        data = self.fh.read()
+        if not data:
+            return
+        lines = (self.partial + data).split('\n')
+        # the last line is incomplete (or empty), it is read again with the rest
+        self.partial = lines.pop()
+
+        added = False
+        for line in lines:
+            if not line:
+                continue
+            self.lines += 1
+            entry = loads(line)
+            if 'recorded' in entry:
+                self.recorded.update(entry['recorded'])
+            elif entry['seq'] > self.seq:
+                self.entries.append(entry)
+                self.seq = entry['seq']
+                added = True
+        if added:
+            self.condition.notify_all()
+
+    def since(self, seq, timeout=0):
+        """
+        Returns the changes after seq, waiting up to timeout seconds if
+        there are none yet, along with the last sequence number and a flag
+        which is set if changes after seq have already been dropped (or seq
+        is from before a restart), the reader has to resync in this case.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            self._sync()
+            while self.seq == seq and time.time() < deadline:
+                if self.filename is None:
+                    self.condition.wait(deadline - time.time())
+                else:
+                    # changes of other processes are only noticed in the file
+                    self.condition.wait(min(self.poll, deadline - time.time()))
+                    self._sync()
+
+            first = self.entries[0]['seq'] if self.entries else self.seq + 1
+            truncated = seq > self.seq or seq + 1 < first
+            changes = [change for change in self.entries if change['seq'] > seq]
+            return changes, self.seq, truncated
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import zlib
+
+from collections import OrderedDict
+
+# is the msgpack module available
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__all__ = ['content_encodings', 'compress', 'pack_msgpack', 'has_msgpack']
+
+# supported content codings, in order of preference, and the zlib window bits producing them
+content_encodings = OrderedDict([('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS)])
+
+def has_msgpack():
+    return msgpack is not None
+
+def compress(chunks, encoding='gzip', level=6):
+    """
+    Compress a stream of chunks with the given content coding. Output is
+    yielded as soon as zlib emits it, the body is never buffered as a whole
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, content_encodings[encoding])
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def pack_msgpack(items, count=None):
+    """
+    Serialize items as MessagePack, one chunk per item. If count is set,
+    the items are preceded by an array header (a single array of count
+    items), otherwise they form a stream of objects
+    """
+    # strings as str (raw) instead of bin, they are text in the configuration
+    packer = msgpack.Packer(use_bin_type=False)
+    if count is not None:
+        yield packer.pack_array_header(count)
+    for item in items:
+        yield packer.pack(item)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+from sqlalchemy import Column
+from sqlalchemy.types import DateTime, Integer, String
+from sqlalchemy.sql import func
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+__all__ = ['Base', 'Log']
+
+class Log(Base):
+    __tablename__ = 'restlos_logs'
+    id = Column(Integer, primary_key=True)
+    logger = Column(String(128))
+    level = Column(String(128))
+    trace = Column(String(1024))
+    msg = Column(String(1024))
+    created_at = Column(DateTime, default=func.now())
+
+    def __init__(self, logger=None, level=None, trace=None, msg=None):
+        self.logger = logger
+        self.level = level
+        self.trace = trace
+        self.msg = msg
+
+    def __unicode__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return "<Log: %s - %s>" % (self.created_at.strftime('%m/%d/%Y-%H:%M:%S'), self.msg[:50])
@@ -1,66 +1,154 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 
+import Queue
 import logging
+import threading
 
-from sqlalchemy import Column, create_engine
-from sqlalchemy.types import DateTime, Integer, String
-from sqlalchemy.sql import func
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+from timeit import default_timer as timer
 
-Base = declarative_base()
+from ..metrics import registry
 
 __all__ = ['SQLHandler']
 
-class Log(Base):
-    __tablename__ = 'restlos_logs'
-    id = Column(Integer, primary_key=True)
-    logger = Column(String(128))
-    level = Column(String(128))
-    trace = Column(String(1024))
-    msg = Column(String(1024))
-    created_at = Column(DateTime, default=func.now())
+write_duration = registry.histogram(
+    'restlos_sql_log_write_seconds',
+    'time spent writing log records to the database (mode: sync or batch)',
+    ['mode']
+)
+records_total = registry.counter(
+    'restlos_sql_log_records_total',
+    'log records handled by SQLHandler (result: written, failed or dropped)',
+    ['result']
+)
 
-    def __init__(self, logger=None, level=None, trace=None, msg=None):
-        self.logger = logger
-        self.level = level
-        self.trace = trace
-        self.msg = msg
-
-    def __unicode__(self):
-        return self.__repr__()
+class SQLHandler(logging.Handler):
+    """
+    SQLHandler: stores log records in a sql database
 
-    def __repr__(self):
-        return "<Log: %s - %s>" % (self.created_at.strftime('%m/%d/%Y-%H:%M:%S'), self.msg[:50])
+    @dsn: sqlalchemy database url
+    @audit: if true, only store [audit] messages
+    @batch_size: if greater than zero, records are queued and written in
+        batches of up to batch_size records by a background thread
+    @flush_interval: a batch is written once it has batch_size records or
+        flush_interval seconds after its first record, 0 writes what is queued
+    @queue_size: maximum number of queued records
+    @overflow: what to do if the queue is full: "drop" the record or "block"
+        the logging thread for up to block_timeout seconds (and drop it then)
+    """
 
-class SQLHandler(logging.Handler):
-    def __init__(self, dsn, audit=False):
+    def __init__(self, dsn, audit=False, batch_size=0, flush_interval=1.0, queue_size=10000, overflow='drop', block_timeout=1.0):
         logging.Handler.__init__(self)
         self.dsn = dsn
         self.audit = audit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped = 0
         self._sql_init()
         self._create()
 
+        if self.batch_size > 0:
+            self.queue = Queue.Queue(queue_size)
+            self.worker = threading.Thread(target=self._worker, name='SQLHandler')
+            self.worker.daemon = True
+            self.worker.start()
+        else:
+            self.queue = None
+
     def _sql_init(self):
+        # sqlalchemy is only imported when the handler is configured
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from models import Base, Log
+
+        self.base = Base
+        self.model = Log
         self.engine = create_engine(self.dsn)
         self.session_maker = sessionmaker(bind=self.engine)
         self.session = None
 
     def _create(self):
-        Base.metadata.create_all(self.engine) 
+        self.base.metadata.create_all(self.engine)
+
+    def _log(self, record):
+        return self.model(logger=record.name, level=record.levelname, trace=str(record.exc_info), msg=record.getMessage())
 
     def emit(self, record):
-        if self.session is None:
-            self.session = self.session_maker()
+        if self.audit and not record.getMessage().startswith('[audit]'):
+            return
 
-        if not self.audit or record.message.startswith('[audit]'):
-            log = Log(logger=record.name, level=record.levelname, trace=str(record.exc_info), msg=record.message)
+        if self.queue is None:
+            if self.session is None:
+                self.session = self.session_maker()
 
-            self.session.add(log)
+            start = timer()
+            self.session.add(self._log(record))
             self.session.commit()
+            write_duration.labels('sync').observe(timer() - start)
+            records_total.labels('written').inc()
+            return
+
+        try:
+            if self.overflow == 'block':
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+            records_total.labels('dropped').inc()
+
+    def _write(self, records):
+        start = timer()
+        try:
+            self.session.add_all([self._log(record) for record in records])
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            records_total.labels('failed').inc(len(records))
+            self.handleError(records[0])
+        else:
+            records_total.labels('written').inc(len(records))
+        write_duration.labels('batch').observe(timer() - start)
+
+    def _worker(self):
+        self.session = self.session_maker()
+        running = True
+        while running:
+            records = [self.queue.get()]
+
+            # collect a batch: up to batch_size records, for at most flush_interval seconds after the first one
+            deadline = timer() + self.flush_interval
+            while len(records) < self.batch_size and records[-1] is not None:
+                remaining = deadline - timer()
+                try:
+                    records.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if None in records:
+                running = False
+            batch = [record for record in records if record is not None]
+            if batch:
+                self._write(batch)
+
+            for record in records:
+                self.queue.task_done()
+
+        self.session.close()
+
+    def flush(self):
+        """ block until every queued record has been written """
+        if self.queue is not None and self.worker.is_alive():
+            self.queue.join()
 
     def close(self):
-        if self.session:
+        if self.queue is not None:
+            if self.worker.is_alive():
+                # the sentinel is queued behind all pending records, the worker drains them first
+                self.queue.put(None)
+                self.worker.join()
+        elif self.session:
             self.session.close()
         logging.Handler.close(self)
@@ -0,0 +1,739 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import gc
+import stat
+import time
+import cPickle
+import logging
+import tempfile
+import threading
+
+from hashlib import sha1
+from itertools import ifilter
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+from lazy import LazyModule
+from query import Query, split_list
+from metrics import registry
+
+# imported when the first index is loaded
+Parsers = LazyModule('pynag.Parsers')
+
+__all__ = ['ObjectIndex']
+
+refresh_duration = registry.histogram(
+    'restlos_index_refresh_seconds',
+    'time spent checking and reparsing the configuration files (result: changed or unchanged)',
+    ['result']
+)
+
+@contextmanager
+def gc_paused():
+    """
+    Pause the cyclic garbage collector: parsing allocates millions of
+    dicts and lists which never form cycles, but every few thousand of
+    them trigger a collection which scans all objects of the index again
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+class Resolved(object):
+    """
+    Resolved: read-only view of an item for matching a query. Attributes
+    defined by the item itself are used as they are, all others are
+    resolved from its templates on first use, so conditions match
+    inherited values as well (like pynag's filter())
+
+    @index: the ObjectIndex holding the templates of the item
+    @item: raw pynag item
+    @defined: attributes matched by their defined values only (the indexed ones)
+    """
+
+    __slots__ = ('index', 'item', 'defined', 'attributes')
+
+    def __init__(self, index, item, defined=()):
+        self.index = index
+        self.item = item
+        self.defined = defined
+        self.attributes = None
+
+    def get(self, key, default=None):
+        value = self.item.get(key)
+        if key in self.defined:
+            return default if value is None else value
+        if isinstance(value, basestring) and not value.startswith('+') and value != 'null':
+            return value
+        if self.attributes is None:
+            self.attributes = self.index.effective(self.item)
+        return self.attributes.get(key, default)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+
+class ObjectIndex(object):
+    """
+    ObjectIndex: process-wide, in-memory index of all nagios object
+    definitions. Every configuration file (cfg_file/cfg_dir entries of the
+    main configuration) is parsed on its own and validated against its
+    mtime, so only files that have changed are parsed again. Exact-match
+    queries on unique keys and relation attributes are answered by
+    dictionary lookups instead of full scans. All other conditions match
+    the attributes inherited from templates as well.
+
+    The attributes of templates after resolving their "use" chains are
+    memoized, a change of a template only drops the cached templates
+    inheriting from it.
+
+    Besides the exact-match indexes, list valued attributes which link
+    objects (ex: service.host_name, host.hostgroups) have field indexes
+    over their comma separated values. All indexes are updated with the
+    objects of the changed files only. Index buckets are never modified in
+    place but replaced, so iterators handed out earlier stay valid.
+
+    The list of configuration files is only built again when nagios.cfg or
+    one of the cfg_dir directories changes. With an interval set, the files
+    are checked for changes at most every "interval" seconds, files changed
+    through the api (invalidate()) are always reparsed right away.
+
+    @cfg_file: path to the main configuration file (nagios.cfg), found by pynag on the first refresh if None
+    @keys: dict of endpoint -> unique key, indexed eagerly
+    @relations: dict of endpoint -> list valued attributes, field indexed eagerly
+    Once loaded, every created, updated or deleted object is recorded in
+    the change log, if one is given.
+
+    Several processes (ex: uwsgi workers) can share a snapshot of the
+    parsed files: a new process loads it instead of parsing everything and
+    only reparses the files which changed since it has been written. With
+    a SharedLock, writers of all processes are serialized (see writing())
+    and the other processes notice their changes right away instead of
+    after the interval.
+
+    @interval: minimum number of seconds between two checks of all files
+    @changes: optional ChangeLog
+    @snapshot: optional file for the snapshot of the parsed files
+    @shared: optional SharedLock of all processes
+    """
+
+    # format of the snapshot file, increment on incompatible changes
+    snapshot_version = 1
+    # the state written to the snapshot, items are shared between files, objects and indexes
+    snapshot_attributes = ('cfg_files', 'order', 'files', 'objects', 'indexes', 'fields')
+
+    def __init__(self, cfg_file=None, keys={}, relations={}, interval=0, changes=None, snapshot=None, shared=None):
+        self.lock = threading.RLock()
+        self._parser = None
+        # None lets pynag find nagios.cfg on the first refresh, see _locate()
+        self.cfg_file = cfg_file
+        self.keys = keys
+        self.relations = relations
+        self.interval = interval
+        self.changes = changes
+        self.snapshot = snapshot
+        self.shared = shared
+
+        self.main_cfg_stamp = None
+        self.listing = None
+        self.checked = 0
+        self.dirty = False
+        self.digest = None
+        self.cfg_files = []
+        self.order = {}
+        self.files = {}
+        self.objects = {}
+        self.indexes = {}
+        self.fields = {}
+        self.templates = {}
+        self.generation = 0
+        self.shared_generation = None
+        self.modified = False
+        self.unsaved = 0
+
+    @property
+    def parser(self):
+        """ pynag's parser, created on first use """
+        if self._parser is None:
+            self._parser = Parsers.config(self.cfg_file)
+        return self._parser
+
+    def _locate(self):
+        """ find nagios.cfg, raises IOError if there is none """
+        if self.cfg_file is None:
+            self.cfg_file = self.parser.cfg_file
+        if not self.cfg_file or not os.path.isfile(self.cfg_file):
+            raise IOError("unable to find nagios.cfg (%s), set nagios_main_cfg" % (self.cfg_file or 'not found', ))
+
+    def _stamp(self, filename):
+        try:
+            result = os.stat(filename)
+        except OSError:
+            return None
+        return (result.st_mtime, result.st_size, result.st_ino)
+
+    def _parse(self, filename):
+        # read the file ourselves: pynag's parse_file() swallows IOErrors
+        with open(filename, 'r') as fh:
+            return self.parser.parse_string(fh.read(), filename=filename)
+
+    def _walk(self):
+        """
+        List the configuration files in the same order as pynag's
+        get_cfg_files(). Returns the directories below the cfg_dir entries
+        and their stamps (the mtime changes when files are added or removed)
+        along with the files
+        """
+        directories = []
+        stamps = []
+        cfg_files = []
+        seen = set()
+        for key, value in self.parser.maincfg_values:
+            if key not in ('cfg_file', 'cfg_dir'):
+                continue
+            if not os.path.isabs(value):
+                value = os.path.join(os.path.dirname(self.cfg_file), value)
+
+            if key == 'cfg_file':
+                found = [os.path.normpath(value)] if os.path.isfile(value) else []
+            else:
+                found = []
+                queue = [value]
+                while queue:
+                    directory = os.path.normpath(queue.pop(0))
+                    if directory in directories or not os.path.isdir(directory):
+                        continue
+                    directories.append(directory)
+                    stamps.append(self._stamp(directory))
+                    for name in os.listdir(directory):
+                        # one lstat per entry, symlinks are resolved like pynag does
+                        filename = os.path.join(directory, name.strip())
+                        try:
+                            mode = os.lstat(filename).st_mode
+                            if stat.S_ISLNK(mode):
+                                filename = os.path.normpath(os.path.join(directory, os.readlink(filename)))
+                                mode = os.stat(filename).st_mode
+                        except OSError:
+                            continue
+                        if stat.S_ISDIR(mode):
+                            queue.append(filename)
+                        elif filename.endswith('.cfg'):
+                            found.append(filename)
+
+            for filename in found:
+                if filename not in seen:
+                    seen.add(filename)
+                    cfg_files.append(filename)
+
+        return directories, stamps, cfg_files
+
+    def _list_files(self):
+        stamp = self._stamp(self.cfg_file)
+        if stamp != self.main_cfg_stamp:
+            self.parser.reset()
+            self.parser.parse_maincfg()
+            self.main_cfg_stamp = stamp
+            self.listing = None
+
+        if self.listing is not None:
+            directories, stamps, cfg_files = self.listing
+            if [self._stamp(directory) for directory in directories] == stamps:
+                return cfg_files
+
+        self.listing = self._walk()
+        return self.listing[2]
+
+    def refresh(self, user=None):
+        """
+        Check every configuration file against the stored mtime/size and
+        reparse the ones which have changed. Returns the set of changed files
+
+        @user: the user who changed the files, for the change log
+        """
+        with self.lock:
+            self._check_shared()
+            if self.interval and not self.dirty and time.time() - self.checked < self.interval:
+                return set()
+
+            if not self.generation and self.snapshot and self.shared is not None:
+                # the first process parses everything and writes the snapshot, the others wait for it
+                with self.shared:
+                    return self._refresh(user)
+            return self._refresh(user)
+
+    def _refresh(self, user=None):
+        with self.lock, gc_paused():
+            start = timer()
+            # changes between the snapshot and the files are not logged, like the initial parse
+            initial = not self.generation
+            self._locate()
+            if initial and self.snapshot:
+                self._load_snapshot()
+
+            cfg_files = self._list_files()
+            self.checked = time.time()
+            self.dirty = False
+
+            old = {}
+            for filename in set(self.files.keys()) - set(cfg_files):
+                old[filename] = self.files.pop(filename)[1]
+
+            for filename in cfg_files:
+                stamp = self._stamp(filename)
+                if filename in self.files and self.files[filename][0] == stamp:
+                    continue
+                parsed = self._parse(filename)
+                self.unsaved += 1
+                if filename in self.files:
+                    old[filename] = self.files[filename][1]
+                self.files[filename] = (stamp, parsed)
+                old.setdefault(filename, [])
+
+            changed = set(old.keys())
+            if changed or cfg_files != self.cfg_files:
+                self.digest = None
+                self.cfg_files = cfg_files
+                self.order = dict([(filename, position) for position, filename in enumerate(cfg_files)])
+                if self.generation:
+                    removed = [item for items in old.itervalues() for item in items]
+                    added = [item for filename in changed if filename in self.files for item in self.files[filename][1]]
+                    self._update(removed, added)
+                    if self.changes is not None and not initial:
+                        stamps = dict([(filename, self.files[filename][0] if filename in self.files else None) for filename in changed])
+                        self.changes.append(self._diff(removed, added, user), stamps)
+                else:
+                    self._rebuild()
+                self.generation += 1
+
+            # a snapshot missing only a few files is good enough, they are parsed on load
+            if self.snapshot and self.unsaved > len(cfg_files) // 10:
+                self._save_snapshot()
+
+            refresh_duration.labels('changed' if changed else 'unchanged').observe(timer() - start)
+            return changed
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot, 'rb') as fh:
+                snapshot = cPickle.load(fh)
+        except (IOError, OSError):
+            return
+        except Exception, err:
+            logging.warn("unable to load snapshot %s: %s" % (self.snapshot, str(err)))
+            return
+
+        if snapshot.get('version') != self.snapshot_version or snapshot.get('cfg_file') != self.cfg_file:
+            return
+
+        # the indexes are part of the snapshot and patched like after any
+        # other change, the stamps of the files are checked as usual
+        for attribute in self.snapshot_attributes:
+            setattr(self, attribute, snapshot[attribute])
+        self.templates = {}
+        self.unsaved = 0
+        self.generation += 1
+
+    def _save_snapshot(self):
+        """ write the snapshot to a temporary file and rename it, readers never see a partial snapshot """
+        snapshot = dict([(attribute, getattr(self, attribute)) for attribute in self.snapshot_attributes])
+        snapshot.update(version=self.snapshot_version, cfg_file=self.cfg_file)
+        fd, filename = tempfile.mkstemp(prefix='.snapshot-', dir=os.path.dirname(os.path.abspath(self.snapshot)))
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                cPickle.dump(snapshot, fh, cPickle.HIGHEST_PROTOCOL)
+            os.rename(filename, self.snapshot)
+        except Exception, err:
+            logging.warn("unable to write snapshot %s: %s" % (self.snapshot, str(err)))
+            if os.path.exists(filename):
+                os.unlink(filename)
+        else:
+            self.unsaved = 0
+
+    def _check_shared(self):
+        """ drop the cached state if another process has written changes """
+        if self.shared is None:
+            return
+        generation = self.shared.generation()
+        if generation != self.shared_generation:
+            self.shared_generation = generation
+            self.dirty = True
+            self.digest = None
+
+    @contextmanager
+    def writing(self):
+        """
+        Context for planning and writing changes: holds the index lock and
+        the SharedLock of all processes, if there is one. The next refresh()
+        checks all files, so changes of other processes are planned against.
+        If files have been written (invalidate()), the generation of the
+        SharedLock is incremented.
+        """
+        with self.lock:
+            if self.shared is None:
+                yield
+                return
+
+            with self.shared:
+                self.dirty = True
+                self.modified = False
+                try:
+                    yield
+                finally:
+                    if self.modified:
+                        self.shared_generation = self.shared.increment()
+
+    def fingerprint(self):
+        """
+        Returns a digest of the current configuration state (mtime, size and
+        inode of every configuration file) without parsing any object file.
+        Within the check interval the last digest is returned.
+        """
+        with self.lock:
+            self._check_shared()
+            if self.interval and not self.dirty and self.digest and time.time() - self.digest[0] < self.interval:
+                return self.digest[1]
+
+            self._locate()
+            cfg_files = self._list_files()
+            stamps = [(self.cfg_file, self.main_cfg_stamp)]
+            stamps += [(filename, self._stamp(filename)) for filename in cfg_files]
+            self.digest = (time.time(), sha1(repr(stamps)).hexdigest())
+            return self.digest[1]
+
+    def invalidate(self, *filenames):
+        """ Force a reparse of the given files on the next refresh """
+        with self.lock:
+            for filename in filenames:
+                filename = os.path.normpath(filename)
+                if filename in self.files:
+                    self.files[filename] = (None, self.files[filename][1])
+                self.dirty = True
+                self.digest = None
+                self.modified = True
+
+    def _position(self, item):
+        """ sort key keeping the order of the configuration files """
+        return (self.order[item['meta']['filename']], item['meta']['line_start'])
+
+    def _merge(self, items, stale, added):
+        """
+        Returns a new list of items without the stale ones (set of ids) and
+        with the added ones inserted at their position in file order
+        """
+        result = [item for item in items if id(item) not in stale] if stale else list(items)
+        for item in added:
+            position = self._position(item)
+            low, high = 0, len(result)
+            while low < high:
+                middle = (low + high) // 2
+                if self._position(result[middle]) < position:
+                    low = middle + 1
+                else:
+                    high = middle
+            result.insert(low, item)
+        return result
+
+    def _values(self, item, attribute, fields):
+        if attribute not in item:
+            return []
+        return set(split_list(item[attribute])) if fields else [item[attribute]]
+
+    def _build(self, endpoint, attribute, fields):
+        index = {}
+        for item in self.objects.get(endpoint, []):
+            for value in self._values(item, attribute, fields):
+                index.setdefault(value, []).append(item)
+        return index
+
+    def _patch(self, index, endpoint, attribute, fields, removed, added):
+        """ replace the buckets of index touched by the removed and added items """
+        stale = set()
+        buckets = {}
+        for item in removed:
+            if item['meta']['object_type'] == endpoint:
+                stale.add(id(item))
+                buckets.update(dict.fromkeys(self._values(item, attribute, fields), ()))
+        for item in added:
+            if item['meta']['object_type'] == endpoint:
+                for value in self._values(item, attribute, fields):
+                    buckets[value] = buckets.get(value, ()) + (item, )
+
+        for value, items in buckets.iteritems():
+            bucket = self._merge(index.get(value, []), stale, items)
+            if bucket:
+                index[value] = bucket
+            else:
+                index.pop(value, None)
+
+    def _rebuild(self):
+        objects = {}
+        for filename in self.cfg_files:
+            for item in self.files[filename][1]:
+                objects.setdefault(item['meta']['object_type'], []).append(item)
+
+        self.objects = objects
+        self.indexes = {}
+        self.fields = {}
+        self.templates = {}
+        for endpoint, key in self.keys.iteritems():
+            self._index(endpoint, key)
+        for endpoint, attributes in self.relations.iteritems():
+            for attribute in attributes:
+                self._fields(endpoint, attribute)
+
+    def _update(self, removed, added):
+        """ update objects and indexes with the items of the changed files only """
+        stale = set([id(item) for item in removed])
+        endpoints = set([item['meta']['object_type'] for item in removed + added])
+        for endpoint in endpoints:
+            self.objects[endpoint] = self._merge(
+                self.objects.get(endpoint, []),
+                stale,
+                [item for item in added if item['meta']['object_type'] == endpoint]
+            )
+
+        for indexes, fields in ((self.indexes, False), (self.fields, True)):
+            for (endpoint, attribute), index in indexes.iteritems():
+                if endpoint in endpoints:
+                    self._patch(index, endpoint, attribute, fields, removed, added)
+
+        self._forget([(item['meta']['object_type'], item['name']) for item in removed + added if 'name' in item])
+
+    def _identity(self, item):
+        object_type = item['meta']['object_type']
+        return (
+            object_type,
+            item.get('name'),
+            item.get(self.keys.get(object_type)),
+            item.get('host_name') if object_type == 'service' else None
+        )
+
+    def _diff(self, removed, added, user=None):
+        """ compare the old and new items of the changed files, returns a list of changes """
+        previous = {}
+        for item in removed:
+            previous.setdefault(self._identity(item), []).append(item)
+
+        now = time.time()
+        def change(action, item):
+            object_type = item['meta']['object_type']
+            return {
+                'time': now,
+                'action': action,
+                'endpoint': object_type,
+                'name': item.get(self.keys.get(object_type)) or item.get('name'),
+                'filename': item['meta']['filename'],
+                'user': user,
+                'attributes': item['meta']['defined_attributes'],
+            }
+
+        changes = []
+        for item in added:
+            candidates = previous.get(self._identity(item))
+            if not candidates:
+                changes.append(change('created', item))
+            elif candidates.pop(0)['meta']['defined_attributes'] != item['meta']['defined_attributes']:
+                changes.append(change('updated', item))
+
+        for items in previous.itervalues():
+            changes += [change('deleted', item) for item in items]
+        return changes
+
+    def _forget(self, templates):
+        """ drop the resolved templates and all templates inheriting from them """
+        templates = list(templates)
+        while templates:
+            object_type, name = templates.pop()
+            if self.templates.pop((object_type, name), None) is None:
+                continue
+            templates += [
+                (object_type, item['name'])
+                for item in self._fields(object_type, 'use').get(name, []) if 'name' in item
+            ]
+
+    def _index(self, endpoint, attribute):
+        """ exact-match index: value -> items """
+        if (endpoint, attribute) not in self.indexes:
+            self.indexes[(endpoint, attribute)] = self._build(endpoint, attribute, False)
+        return self.indexes[(endpoint, attribute)]
+
+    def _fields(self, endpoint, attribute):
+        """ field index of a comma separated attribute: field -> items """
+        if (endpoint, attribute) not in self.fields:
+            self.fields[(endpoint, attribute)] = self._build(endpoint, attribute, True)
+        return self.fields[(endpoint, attribute)]
+
+    def _template(self, object_type, name, chain):
+        key = (object_type, name)
+        if key in chain:
+            # circular inheritance, nagios refuses this configuration anyway
+            return {}
+        if key not in self.templates:
+            templates = self._index(object_type, 'name').get(name)
+            self.templates[key] = self._resolve(templates[0], chain + (key, )) if templates else {}
+        return self.templates[key]
+
+    def _resolve(self, item, chain=()):
+        object_type = item['meta']['object_type']
+        attributes = {}
+        # the first template listed in "use" takes precedence
+        for name in reversed(split_list(item.get('use', ''))):
+            attributes.update(self._template(object_type, name, chain))
+        attributes.pop('name', None)
+        attributes.pop('register', None)
+
+        for key, value in item['meta']['defined_attributes'].iteritems():
+            if value.startswith('+'):
+                # additive inheritance
+                inherited = attributes.get(key)
+                value = value[1:] if inherited in (None, 'null') else "%s,%s" % (inherited, value[1:])
+            attributes[key] = value
+        return attributes
+
+    def effective(self, item):
+        """
+        Returns the attributes of item after resolving its templates the
+        way nagios does: the first template in "use" wins, "+value" is
+        appended to the inherited value and "null" removes an attribute
+        """
+        with self.lock:
+            attributes = self._resolve(item)
+        return dict([(key, value) for key, value in attributes.iteritems() if value != 'null'])
+
+    def all(self, endpoint):
+        with self.lock:
+            self.refresh()
+            return self.objects.get(endpoint, [])
+
+    def lookup(self, endpoint, attribute, values, refresh=True):
+        """
+        Resolve many values of one attribute in a single pass. Returns a
+        dict of value -> first item having exactly this value
+        """
+        with self.lock:
+            if refresh:
+                self.refresh()
+            index = self._index(endpoint, attribute)
+            return dict([
+                (value, index[value][0]) for value in values
+                if isinstance(value, basestring) and value in index
+            ])
+
+    def _candidates(self, endpoint, attribute, values, fields=False):
+        index = self._fields(endpoint, attribute) if fields else self._index(endpoint, attribute)
+        buckets = [index[value] for value in values if value in index]
+        if len(buckets) == 1:
+            return buckets[0]
+        # keep the order of the configuration files
+        return sorted([item for bucket in buckets for item in bucket], key=self._position)
+
+    def _indexed(self, endpoint):
+        """
+        only the unique key and the relation attributes of an endpoint are
+        indexed, by the values defined in the objects. Other attributes are
+        often inherited from templates
+        """
+        return frozenset([self.keys.get(endpoint)] + list(self.relations.get(endpoint, ())))
+
+    def resolved(self, item):
+        """ view of item matching inherited attributes as well, see Resolved """
+        return Resolved(self, item, self._indexed(item['meta']['object_type']))
+
+    def _matcher(self, endpoint, query, skip=None):
+        """ match the conditions not answered by the index, resolving inherited attributes if needed """
+        match = query.matcher(skip)
+        indexed = self._indexed(endpoint)
+        if all([attribute in indexed for position, attribute in enumerate(query.attributes) if position != skip]):
+            return match
+        return lambda item: match(Resolved(self, item, indexed))
+
+    def _select(self, endpoint, query):
+        """
+        Select the candidates of a query from the smallest index matching
+        an exact, __in or __has_field condition. Returns the candidates and
+        the position of the condition answered by the index (or None)
+        """
+        indexed = self._indexed(endpoint)
+        candidates = [
+            (self._candidates(endpoint, *condition), position) for position, condition in query.indexed().iteritems()
+            if condition[0] in indexed
+        ]
+        if candidates:
+            return min(candidates, key=lambda candidate: len(candidate[0]))
+        return self.objects.get(endpoint, []), None
+
+    def iterfilter(self, endpoint, query=None, refresh=True, **conditions):
+        """
+        Returns an iterator over all raw pynag items of an endpoint matching
+        the query (a Query, or conditions in the syntax of pynag's filter(),
+        see Query). Candidates are selected right away from the smallest
+        index matching an exact, __in or __has_field condition, the
+        remaining conditions are checked lazily while iterating.
+        """
+        if not isinstance(query, Query):
+            query = Query(dict(query or {}, **conditions))
+
+        with self.lock:
+            if refresh:
+                self.refresh()
+            candidates, skip = self._select(endpoint, query)
+
+        # the condition answered by the index does not have to be checked again
+        return ifilter(self._matcher(endpoint, query, skip), candidates)
+
+    def count(self, endpoint, query=None, group_by=None, refresh=True, **conditions):
+        """
+        Count the items matching the query without copying them. With
+        group_by, the items are counted per value of this attribute as
+        well (per field for relation attributes). Returns a dict with the
+        count and the groups. Whenever possible, the numbers are taken
+        from the size of the index buckets.
+        """
+        if not isinstance(query, Query):
+            query = Query(dict(query or {}, **conditions))
+        fields = group_by in self.relations.get(endpoint, [])
+
+        with self.lock:
+            if refresh:
+                self.refresh()
+            candidates, skip = self._select(endpoint, query)
+            exact = len(query.conditions) == (0 if skip is None else 1)
+
+            indexes = self.fields if fields else self.indexes
+            if group_by is not None and not query and (endpoint, group_by) in indexes:
+                groups = indexes[(endpoint, group_by)]
+                return {
+                    'count': len(candidates),
+                    'groups': dict([(value, len(items)) for value, items in groups.iteritems()])
+                }
+
+        if exact and group_by is None:
+            return {'count': len(candidates)}
+
+        count = 0
+        groups = {}
+        for item in ifilter(self._matcher(endpoint, query, skip), candidates):
+            count += 1
+            if group_by is not None:
+                for value in self._values(item, group_by, fields):
+                    groups[value] = groups.get(value, 0) + 1
+
+        if group_by is None:
+            return {'count': count}
+        return {'count': count, 'groups': groups}
+
+    def filter(self, endpoint, query=None, refresh=True, **conditions):
+        """ Returns a list of all raw pynag items matching the query """
+        return list(self.iterfilter(endpoint, query, refresh, **conditions))
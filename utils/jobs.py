@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import time
+import uuid
+import logging
+import threading
+
+from collections import OrderedDict
+
+__all__ = ['Job', 'JobQueue', 'RestartScheduler']
+
+class Job(object):
+    """
+    Job: one run of a function in a background thread
+    """
+
+    def __init__(self, key, function, *args, **kwargs):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'running'
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, args=(function, args, kwargs), name='Job-%s' % (self.id, ))
+        self.thread.daemon = True
+
+    def _run(self, function, args, kwargs):
+        try:
+            self.result = function(*args, **kwargs)
+            self.status = 'finished'
+        except Exception, err:
+            logging.error("job %s failed: %s" % (self.id, str(err)))
+            self.result = str(err)
+            self.status = 'failed'
+        self.finished = time.time()
+        self.done.set()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.done.is_set()
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'key': self.key,
+            'status': self.status,
+            'result': self.result,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue(object):
+    """
+    JobQueue: runs functions as background jobs, deduplicated by a key.
+    Submitting a key which is already running returns the running job, a
+    key which has already finished returns the cached job. Only the last
+    "history" jobs are kept.
+    """
+
+    def __init__(self, history=32):
+        self.history = history
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.keys = {}
+
+    def submit(self, key, function, *args, **kwargs):
+        with self.lock:
+            job = self.keys.get(key)
+            if job is not None and job.status != 'failed':
+                return job
+
+            job = Job(key, function, *args, **kwargs)
+            self.jobs[job.id] = job
+            self.keys[key] = job
+            while len(self.jobs) > self.history:
+                old_id, old = self.jobs.popitem(last=False)
+                if self.keys.get(old.key) is old:
+                    del self.keys[old.key]
+
+        job.thread.start()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def find(self, key):
+        """ the running or cached job of key, None if submit() would start a new one """
+        with self.lock:
+            job = self.keys.get(key)
+            return job if job is not None and job.status != 'failed' else None
+
+
+class RestartScheduler(object):
+    """
+    RestartScheduler: coalesces restart requests. The first request opens a
+    window of "window" seconds, every request arriving within this window
+    joins the pending restart, which is executed once when the window ends.
+    If a verify function is given, it is run first and the restart is
+    skipped if the configuration does not verify (returncode != 0).
+    A window of 0 restarts right away, in the requesting thread.
+
+    @window: seconds to wait for further restart requests
+    @verify: optional function returning a verify result ({'returncode': ..., 'output': ...})
+    """
+
+    # keys of the pending restart which are not part of its state
+    internal = ('restart', 'done', 'result')
+
+    def __init__(self, window=0, verify=None):
+        self.window = window
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.pending = None
+        self.last = None
+
+    def request(self, username, restart):
+        """
+        Request a restart, restart is the function sending the actual
+        restart command. Returns the restart state.
+        """
+        with self.lock:
+            if self.pending is None:
+                self.pending = {
+                    'scheduled': time.time() + self.window, 'requests': 0, 'users': [],
+                    'restart': restart, 'done': threading.Event(), 'result': None,
+                }
+                if self.window > 0:
+                    timer = threading.Timer(self.window, self._fire)
+                    timer.daemon = True
+                    timer.start()
+            self.pending['requests'] += 1
+            if username not in self.pending['users']:
+                self.pending['users'].append(username)
+            pending = self.pending
+
+        if self.window <= 0:
+            # a concurrent request may be executing this restart already, wait for its result
+            self._fire()
+            pending['done'].wait()
+            if pending['result']['status'] == 'failed':
+                raise Exception(pending['result']['message'])
+            return dict(self.state(), last=pending['result'])
+
+        return self.state()
+
+    def _fire(self):
+        with self.lock:
+            pending, self.pending = self.pending, None
+        if pending is None:
+            # already executed by a concurrent request
+            return
+
+        last = {'time': time.time(), 'requests': pending['requests'], 'users': pending['users'], 'verify': None}
+        try:
+            if self.verify:
+                last['verify'] = self.verify()
+            if last['verify'] and last['verify']['returncode'] != 0:
+                last['status'] = 'skipped'
+                last['message'] = 'configuration did not verify, restart skipped'
+            else:
+                pending['restart']()
+                last['status'] = 'restarted'
+                last['message'] = 'successfully sent command to command file'
+        except Exception, err:
+            last['status'] = 'failed'
+            last['message'] = str(err)
+
+        logging.warn("[audit] restart of the core %s (%d requests by %s): %s" % (
+            last['status'], last['requests'], ', '.join(last['users']), last['message'])
+        )
+        self.last = last
+        pending['result'] = last
+        pending['done'].set()
+
+    def state(self):
+        with self.lock:
+            pending = self.pending and dict([(k, v) for k, v in self.pending.iteritems() if k not in self.internal])
+            return {'pending': pending, 'last': self.last}
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import importlib
+
+__all__ = ['LazyModule']
+
+class LazyModule(object):
+    """
+    LazyModule: stands in for a module which is only imported when one of
+    its attributes is used for the first time, heavy modules (ex:
+    pynag.Model) do not slow down the start of a process which does not
+    need them yet
+
+    @name: full name of the module (ex: pynag.Model)
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        return "<LazyModule %s%s>" % (self._name, '' if self._module is None else ' (loaded)')
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import fcntl
+import threading
+
+__all__ = ['SharedLock']
+
+class SharedLock(object):
+    """
+    SharedLock: advisory lock (flock) on a file, shared by all processes of
+    the api (ex: uwsgi workers), which also holds a generation counter.
+    Writers hold the lock while they plan and write their changes and
+    increment the counter afterwards, so the other processes know their
+    cached state is outdated. flock() locks belong to the open file, the
+    lock is held by one thread of a process at a time.
+
+    @filename: the lock file, created if it does not exist
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0644)
+        self.pid = os.getpid()
+        self.depth = 0
+
+    def _reopen(self):
+        """
+        A forked process (ex: uwsgi worker forked after the application was
+        loaded) shares the open file - and with it the lock - of its parent,
+        it needs a file of its own
+        """
+        if self.pid != os.getpid():
+            fd, self.fd = self.fd, os.open(self.filename, os.O_RDWR | os.O_CREAT, 0644)
+            self.pid = os.getpid()
+            os.close(fd)
+
+    def acquire(self):
+        self.lock.acquire()
+        if not self.depth:
+            try:
+                self._reopen()
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            except:
+                self.lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if not self.depth:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def generation(self):
+        """ the current value of the counter, readable without the lock """
+        with open(self.filename, 'r') as fh:
+            try:
+                return int(fh.read(32) or 0)
+            except ValueError:
+                return 0
+
+    def increment(self):
+        """ increment the counter, the lock has to be held """
+        generation = self.generation() + 1
+        # one write of a few bytes, readers never see a partial value
+        value = '%-31d\n' % (generation, )
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.write(self.fd, value)
+        return generation
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import threading
+
+from bisect import bisect_left
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+__all__ = ['Counter', 'Histogram', 'Registry', 'registry']
+
+# upper bounds (seconds) of the latency buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def format_labels(names, values, extra=()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % (','.join(['%s="%s"' % (name, escape_label(value)) for name, value in pairs]), )
+
+
+class Metric(object):
+    """
+    Metric: a family of values sharing a name, one value per combination
+    of label values. Values are only aggregated in place when they are
+    updated, the text format is rendered when the metrics are scraped.
+
+    @name: metric name (ex: restlos_request_duration_seconds)
+    @documentation: help text
+    @labels: names of the labels
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def _child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """ returns the value for the given label values, created on first use """
+        key = tuple([unicode(value) for value in values])
+        try:
+            return self.children[key]
+        except KeyError:
+            if len(key) != len(self.labelnames):
+                raise ValueError("%s expects the labels %s" % (self.name, ', '.join(self.labelnames)))
+            with self.lock:
+                return self.children.setdefault(key, self._child())
+
+    def _samples(self, key, child):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation.replace('\\', '\\\\').replace('\n', '\\n')),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        with self.lock:
+            children = sorted(self.children.items())
+        for key, child in children:
+            lines += self._samples(key, child)
+        return lines
+
+
+class CounterValue(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """
+    Counter: a value which only ever increases (ex: number of dropped log
+    records), the name should end with _total
+    """
+
+    kind = 'counter'
+
+    def _child(self):
+        return CounterValue()
+
+    def _samples(self, key, child):
+        return ['%s%s %s' % (self.name, format_labels(self.labelnames, key), format_value(child.value))]
+
+
+class HistogramTimer(object):
+    """ context manager observing the time spent in its block """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(timer() - self.start)
+
+
+class HistogramValue(object):
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        # per bucket counts (not cumulative), the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        position = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return HistogramTimer(self)
+
+    def iterate(self, iterable):
+        """
+        Pass through a (lazy) iterable, observing the time spent producing
+        its items once it is exhausted or closed
+        """
+        elapsed = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = timer()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += timer() - start
+                    break
+                elapsed += timer() - start
+                yield item
+        finally:
+            self.observe(elapsed)
+
+
+class Histogram(Metric):
+    """
+    Histogram: counts observations (ex: request durations) in buckets of
+    configurable upper bounds, along with their sum and count
+
+    @buckets: sorted upper bounds of the buckets, +Inf is added
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return HistogramValue(self.buckets)
+
+    def _samples(self, key, child):
+        with child.lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+
+        lines = []
+        cumulative = 0
+        for bound, observed in zip(self.buckets + (float('inf'), ), counts):
+            cumulative += observed
+            lines.append('%s_bucket%s %d' % (self.name, format_labels(self.labelnames, key, [('le', format_value(bound))]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, format_labels(self.labelnames, key), format_value(total)))
+        lines.append('%s_count%s %d' % (self.name, format_labels(self.labelnames, key), count))
+        return lines
+
+
+class Registry(object):
+    """
+    Registry: the metrics of the process, rendered in the prometheus text
+    exposition format for the /metrics endpoint
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = OrderedDict()
+
+    def register(self, metric):
+        """ add a metric, returns the already registered one of the same name and type """
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is None:
+                self.metrics[metric.name] = metric
+                return metric
+        if type(existing) != type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError("metric %s is already registered with a different type or labels" % (metric.name, ))
+        return existing
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = self.metrics.values()
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+# metrics of this process
+registry = Registry()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import sys
+import time
+import uuid
+import pstats
+import random
+import marshal
+import cProfile
+import threading
+
+from StringIO import StringIO
+from collections import OrderedDict
+from timeit import default_timer as timer
+from flask import request, current_app
+from werkzeug.exceptions import HTTPException
+
+__all__ = ['Profile', 'ProfileStore', 'Profiler']
+
+class Profile(object):
+    """
+    Profile: the cProfile statistics of one request along with the request
+    it belongs to
+    """
+
+    def __init__(self, profile_id, profiler, user, method, url, reason):
+        self.id = profile_id
+        self.profiler = profiler
+        self.user = user
+        self.method = method
+        self.url = url
+        self.reason = reason
+        self.started = time.time()
+        self.duration = None
+        self.status = None
+
+    def report(self, sort='cumulative', limit=50):
+        """ the statistics as text, the "limit" most expensive functions sorted by "sort" """
+        stream = StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self):
+        """ the statistics in the format of pstats.dump_stats(), for snakeviz & co """
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'user': self.user,
+            'method': self.method,
+            'url': self.url,
+            'reason': self.reason,
+            'started': self.started,
+            'duration': self.duration,
+            'status': self.status,
+        }
+
+
+class ProfileStore(object):
+    """
+    ProfileStore: keeps the last "size" profiles
+    """
+
+    def __init__(self, size=20):
+        self.size = size
+        self.lock = threading.Lock()
+        self.profiles = OrderedDict()
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles[profile.id] = profile
+            while len(self.profiles) > self.size:
+                self.profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def list(self):
+        """ all profiles, newest first """
+        with self.lock:
+            return list(reversed(self.profiles.values()))
+
+
+class Profiler(object):
+    """
+    Profiler: Class decorator for flask views, runs the view (and the
+    streaming of its response) under cProfile if the client asks for it
+    with ?_profile=1 or the X-Profile header, or - with a threshold set -
+    for a sample of all requests. Requested profiles and the ones slower
+    than the threshold are added to the store. Has to be applied after
+    Authentify, only the configured users (all if there are none) may ask
+    for profiles.
+
+    @config: the "profiling" section of the configuration
+    @store: ProfileStore for the taken profiles
+
+    example:
+    ========
+
+    {
+        "enabled": true,
+        "users": [ "admin" ],
+        "threshold": 2.0,
+        "sample": 0.1,
+        "size": 20
+    }
+
+    """
+
+    argument = '_profile'
+    header = 'X-Profile'
+
+    def __init__(self, config, store):
+        self.enabled = config.get('enabled', False)
+        self.users = config.get('users', [])
+        self.threshold = config.get('threshold', 0)
+        self.sample = config.get('sample', 0.1)
+        self.store = store
+        self.random = random.Random()
+
+    def allowed(self, username):
+        return self.enabled and (not self.users or username in self.users)
+
+    def _requested(self):
+        value = request.args.get(self.argument, request.headers.get(self.header, ''))
+        return value.lower() in ('1', 'true', 'yes', 'on')
+
+    def _sampled(self):
+        return self.threshold > 0 and self.random.random() < self.sample
+
+    def _finish(self, profile, start, requested, status):
+        profile.duration = timer() - start
+        profile.status = status
+        if requested or profile.duration >= self.threshold:
+            self.store.add(profile)
+
+    def _iterate(self, profiler, iterable):
+        """ profile the production of every chunk of a streamed response, not the writes in between """
+        iterator = iter(iterable)
+        while True:
+            profiler.enable()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                profiler.disable()
+            yield item
+
+    def _profile(self, requested, f, args, kwargs):
+        profile = Profile(
+            uuid.uuid4().hex, cProfile.Profile(), request.authorization.username,
+            request.method, request.full_path if request.query_string else request.path,
+            'requested' if requested else 'slow'
+        )
+
+        start = timer()
+        profile.profiler.enable()
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+        except:
+            profile.profiler.disable()
+            err = sys.exc_info()[1]
+            self._finish(profile, start, requested, err.code if isinstance(err, HTTPException) else 500)
+            raise
+        profile.profiler.disable()
+
+        if response.is_streamed:
+            response.response = self._iterate(profile.profiler, response.response)
+        response.call_on_close(lambda: self._finish(profile, start, requested, response.status_code))
+        if requested:
+            response.headers[self.header + '-Id'] = profile.id
+        return response
+
+    def __call__(self, f):
+        def wrapped_function(*args, **kwargs):
+            if self.enabled:
+                requested = self._requested() and self.allowed(request.authorization.username)
+                if requested or self._sampled():
+                    return self._profile(requested, f, args, kwargs)
+            return f(*args, **kwargs)
+
+        return wrapped_function
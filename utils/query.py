@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import re
+
+__all__ = ['Query']
+
+def split_list(value):
+    """ split a comma separated attribute value (ex: hostgroups), ignoring a leading '+' """
+    return [field.strip() for field in value.lstrip('+').split(',') if field.strip()]
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if str(value).lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError("invalid boolean value: %s" % (value, ))
+
+class Query(object):
+    """
+    Query: a set of conditions on object attributes, compiled once and
+    matched against many objects. Conditions use the operator suffixes of
+    pynag's filter() (ex: host_name__startswith=web), all conditions have
+    to match.
+
+    Operators:
+    - attr=value                 exact match
+    - attr__isnot=value          not equal
+    - attr__in=a,b,c             exact match on any of the values
+    - attr__notin=a,b,c          none of the values
+    - attr__contains=value       substring (also __notcontains)
+    - attr__startswith=value     prefix (also __notstartswith)
+    - attr__endswith=value       suffix (also __notendswith)
+    - attr__regex=expr           regular expression search
+    - attr__exists=1|0           attribute is (not) defined
+    - attr__isnull=1|0           attribute is (not) undefined or empty
+    - attr__has_field=value      comma separated list attribute (ex: hostgroups) contains value
+
+    @conditions: dict of attr[__operator] -> value (a value may be a list for __in/__notin)
+    """
+
+    operators = [
+        'isnot', 'in', 'notin', 'contains', 'notcontains', 'startswith', 'notstartswith',
+        'endswith', 'notendswith', 'regex', 'exists', 'isnull', 'has_field'
+    ]
+
+    def __init__(self, conditions={}):
+        self.conditions = []
+        for key, value in conditions.iteritems():
+            attribute, operator = self.split(key)
+            self.conditions.append((attribute, operator, self._value(operator, value)))
+        self.predicates = [self._compile(*condition) for condition in self.conditions]
+
+    @classmethod
+    def split(cls, key):
+        """ split a condition key into attribute and operator (None for exact matches) """
+        if '__' in key:
+            attribute, operator = key.rsplit('__', 1)
+            if operator in cls.operators:
+                return attribute, operator
+        return key, None
+
+    @property
+    def attributes(self):
+        return [attribute for attribute, operator, value in self.conditions]
+
+    def _value(self, operator, value):
+        if operator in ('in', 'notin'):
+            values = value if isinstance(value, (list, tuple)) else split_list(value)
+            if not all([isinstance(item, basestring) for item in values]):
+                raise ValueError("values of __%s have to be strings" % (operator, ))
+            return frozenset(values)
+        elif isinstance(value, (list, tuple, dict)):
+            raise ValueError("only __in and __notin accept a list of values")
+        elif operator in ('exists', 'isnull'):
+            return parse_bool(value)
+        elif operator == 'regex':
+            try:
+                return re.compile(value)
+            except re.error, err:
+                raise ValueError("invalid regular expression %s: %s" % (value, str(err)))
+        return value
+
+    def _compile(self, attribute, operator, value):
+        if operator is None:
+            return lambda item: item.get(attribute) == value
+        elif operator == 'isnot':
+            return lambda item: item.get(attribute) != value
+        elif operator == 'in':
+            return lambda item: item.get(attribute) in value
+        elif operator == 'notin':
+            return lambda item: item.get(attribute) not in value
+        elif operator == 'contains':
+            return lambda item: value in item.get(attribute, '')
+        elif operator == 'notcontains':
+            return lambda item: value not in item.get(attribute, '')
+        elif operator == 'startswith':
+            return lambda item: item.get(attribute, '').startswith(value)
+        elif operator == 'notstartswith':
+            return lambda item: not item.get(attribute, '').startswith(value)
+        elif operator == 'endswith':
+            return lambda item: item.get(attribute, '').endswith(value)
+        elif operator == 'notendswith':
+            return lambda item: not item.get(attribute, '').endswith(value)
+        elif operator == 'regex':
+            return lambda item: attribute in item and value.search(item[attribute]) is not None
+        elif operator == 'exists':
+            return lambda item: (attribute in item) == value
+        elif operator == 'isnull':
+            return lambda item: (not item.get(attribute)) == value
+        elif operator == 'has_field':
+            return lambda item: value in split_list(item.get(attribute, ''))
+
+    def indexed(self):
+        """
+        Conditions which can be answered by an index, as a dict of
+        position -> (attribute, values, fields), fields is set for field
+        indexes
+        """
+        return dict([
+            (position, (attribute, value if operator == 'in' else [value], operator == 'has_field'))
+            for position, (attribute, operator, value) in enumerate(self.conditions)
+            if operator in (None, 'in', 'has_field')
+        ])
+
+    def matcher(self, skip=None):
+        """ returns a function matching all conditions but the one at position skip """
+        predicates = [predicate for position, predicate in enumerate(self.predicates) if position != skip]
+        def match(item):
+            for predicate in predicates:
+                if not predicate(item):
+                    return False
+            return True
+        return match
+
+    def match(self, item):
+        for predicate in self.predicates:
+            if not predicate(item):
+                return False
+        return True
+
+    def __nonzero__(self):
+        return bool(self.conditions)
+
+    def __repr__(self):
+        return "Query(%r)" % (self.conditions, )
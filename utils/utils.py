@@ -41,10 +41,52 @@ class Config(dict):
             'sudo': False,
             'output_dir': '/etc/nagios/objects/api',
             'port': 5000,
+            'schema_cache': None, # file caching the object attributes and nagios.cfg values, speeds up the start
+            'index': {
+                'interval': 1, # seconds between checks of the config files for external changes
+                'snapshot': None, # file for a snapshot of the parsed config files, shared by all processes
+                'lock_file': None, # lock file serializing the writes of all processes (ex: uwsgi workers)
+                'preload': False # load the index on start, before uwsgi forks its workers
+            },
+            'changes': {
+                'size': 1000, # number of changes kept for /changes
+                'timeout': 60, # maximum seconds a request to /changes waits for new changes
+                'file': None # file holding the change log of all processes, needs index.lock_file with several processes
+            },
+            'compression': {
+                'enabled': True, # gzip/deflate responses for clients sending Accept-Encoding
+                'level': 6 # zlib level, 1 is fastest
+            },
+            'profiling': {
+                'enabled': False, # allow profiling of requests at all
+                'users': [], # users who may ask for profiles with ?_profile=1, empty allows everyone
+                'threshold': 0, # seconds, keep the profiles of sampled requests slower than this, 0 disables it
+                'sample': 0.1, # fraction of the requests profiled for the threshold
+                'size': 20 # number of profiles kept
+            },
+            'admission': {
+                'enabled': True, # limit the concurrent requests of every cost class (per process)
+                'bulk_size': 100, # POST/batch requests with more objects are "bulk" requests
+                'classes': { # limit: concurrent requests (0: unlimited), queue: waiting requests, timeout: seconds waiting
+                    'read': {'limit': 0, 'queue': 0, 'timeout': 0}, # GET with exact matches only
+                    'scan': {'limit': 8, 'queue': 16, 'timeout': 10}, # GET with wildcards, operators or without conditions
+                    'write': {'limit': 4, 'queue': 16, 'timeout': 30}, # POST up to bulk_size objects, DELETE with exact matches
+                    'bulk': {'limit': 1, 'queue': 4, 'timeout': 30}, # larger POST/batch, DELETE with wildcards or operators
+                    'control': {'limit': 1, 'queue': 8, 'timeout': 60} # verify (and restart with restart.verify) without a cached result
+                }
+            },
+            'restart': {
+                'window': 0, # seconds to coalesce restart requests, 0 restarts right away
+                'verify': False # verify the configuration first, skip the restart if it fails
+            },
             'host': "127.0.0.1",
             'auth': {
                 'provider': 'AuthDict',
-                'params': {}
+                'params': {},
+                'cache': {
+                    'ttl': 0, # seconds, 0 disables the credential cache
+                    'size': 1024
+                }
             },
             'logging': {
                 'version': 1,
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import re
+import difflib
+import tempfile
+
+from collections import OrderedDict
+
+__all__ = ['ConfigWriter']
+
+class ConfigWriter(object):
+    """
+    ConfigWriter: collects changes to nagios object definitions, groups them
+    by their configuration file and rewrites every touched file exactly once.
+    Files are written to a temporary file in the same directory first and
+    renamed over the original, so readers never see a half written file.
+
+    @index: the ObjectIndex which holds the objects being changed
+    @directory: directory where new objects are placed (output_dir)
+    """
+
+    invalid_chars = re.compile('[/\s\'\"\|]')
+
+    def __init__(self, index, directory):
+        self.index = index
+        self.directory = directory
+        self.changes = OrderedDict()
+        self.backups = OrderedDict()
+        self.written = {}
+
+    def _queue(self, filename, change):
+        filename = os.path.normpath(filename)
+        self.changes.setdefault(filename, []).append(change)
+        return filename
+
+    def add(self, object_type, attributes, filename=None):
+        """ queue a new object definition, returns the target filename """
+        filename = filename or self.suggest_filename(object_type, attributes)
+        return self._queue(filename, ('add', object_type, attributes))
+
+    def update(self, item, attributes):
+        """ queue changed attributes of an existing item, returns its filename """
+        return self._queue(item['meta']['filename'], ('update', item, attributes))
+
+    def remove(self, item):
+        """ queue the removal of an existing item, returns its filename """
+        return self._queue(item['meta']['filename'], ('remove', item, None))
+
+    def discard(self, filename, attributes):
+        """ drop a queued new object again (ex: deleted later in the same batch) """
+        changes = self.changes.get(filename, [])
+        changes[:] = [change for change in changes if change[0] != 'add' or change[2] is not attributes]
+        if not changes:
+            self.changes.pop(filename, None)
+
+    def suggest_filename(self, object_type, attributes):
+        """ same placement rules as pynag's ObjectDefinition.get_suggested_filename() """
+        if object_type == 'service' and attributes.get('service_description') and attributes.get('host_name'):
+            shortname = "%s/%s" % (attributes['host_name'], attributes['service_description'])
+        else:
+            shortname = attributes.get('service_description' if object_type == 'service' else "%s_name" % (object_type, ))
+
+        description = self.invalid_chars.sub('', attributes.get('name') or shortname or "Untitled %s" % (object_type, ))
+        object_type = self.invalid_chars.sub('', object_type)
+
+        # services go to the same file as their host
+        if object_type == 'service' and attributes.get('host_name'):
+            host = self.index.lookup('host', 'host_name', [attributes['host_name']], refresh=False)
+            if host:
+                return host.values()[0]['meta']['filename']
+
+        if str(attributes.get('register', '1')) != '1':
+            return "%s/templates/%ss.cfg" % (self.directory, object_type)
+        elif object_type == 'service':
+            filename = self.invalid_chars.sub('', attributes.get('name') or attributes.get('service_description') or "untitled")
+            return "%s/%ss/%s.cfg" % (self.directory, object_type, filename)
+
+        return "%s/%ss/%s.cfg" % (self.directory, object_type, description)
+
+    def _line(self, key, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return "\t%-30s%s\n" % (key, value)
+
+    def _render(self, object_type, attributes):
+        lines = ["define %s {\n" % (object_type, )]
+        lines += [self._line(key, value) for key, value in attributes.iteritems() if value is not None]
+        lines.append("}\n")
+        return lines
+
+    def _edit(self, lines, attributes):
+        # join line continuations, the same way pynag does before editing
+        joined = []
+        for line in lines:
+            if joined and joined[-1].endswith('\\\n'):
+                joined[-1] = joined[-1][:-2] + line.lstrip()
+            else:
+                joined.append(line)
+        lines = joined
+
+        result = [lines[0]]
+        seen = set()
+        for line in lines[1:-1]:
+            key = line.split(None, 1)[0] if line.strip() else None
+            if key not in attributes:
+                result.append(line)
+            elif key not in seen:
+                seen.add(key)
+                if attributes[key] is not None:
+                    result.append(self._line(key, attributes[key]))
+
+        for key, value in attributes.iteritems():
+            if key not in seen and value is not None:
+                result.append(self._line(key, value))
+
+        result.append(lines[-1])
+        return result
+
+    def _locate(self, parsed, item):
+        """ find the definition of item in a freshly parsed file """
+        candidates = [
+            i for i in parsed
+            if i['meta']['object_type'] == item['meta']['object_type']
+            and i['meta']['defined_attributes'] == item['meta']['defined_attributes']
+        ]
+        if not candidates:
+            raise ValueError("unable to find %s object in %s" % (item['meta']['object_type'], item['meta']['filename']))
+
+        for candidate in candidates:
+            if candidate['meta']['line_start'] == item['meta'].get('line_start'):
+                return candidate
+        return candidates[0]
+
+    def _apply(self, filename, changes):
+        try:
+            with open(filename, 'r') as fh:
+                lines = fh.readlines()
+        except IOError:
+            if any(action != 'add' for action, target, attributes in changes):
+                raise
+            lines = []
+
+        parsed = self.index.parser.parse_string(''.join(lines), filename=filename)
+
+        # line_start -> [line_end, definition lines]
+        definitions = {}
+        appended = []
+        for action, target, attributes in changes:
+            if action == 'add':
+                appended.append(self._render(target, attributes))
+                continue
+
+            item = self._locate(parsed, target)
+            start, end = item['meta']['line_start'], item['meta']['line_end']
+            if start not in definitions:
+                definitions[start] = [end, lines[start - 1:end]]
+            if definitions[start][1] is None:
+                raise ValueError("%s object in %s has already been removed" % (target['meta']['object_type'], filename))
+
+            if action == 'update':
+                definitions[start][1] = self._edit(definitions[start][1], attributes)
+            else:
+                definitions[start][1] = None
+
+        for start in sorted(definitions.keys(), reverse=True):
+            end, definition = definitions[start]
+            lines[start - 1:end] = definition or []
+
+        if appended and lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        for definition in appended:
+            if lines and lines[-1].strip():
+                lines.append('\n')
+            lines.extend(definition)
+
+        return ''.join(lines)
+
+    def _write(self, filename, content):
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            stat = None
+
+        fd, tmpname = tempfile.mkstemp(prefix='.%s.' % (os.path.basename(filename), ), suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(content)
+                fh.flush()
+                os.fsync(fh.fileno())
+            if stat:
+                os.chmod(tmpname, stat.st_mode & 07777)
+                try:
+                    os.chown(tmpname, stat.st_uid, stat.st_gid)
+                except OSError:
+                    pass
+            else:
+                os.chmod(tmpname, 0644)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+
+    def _read(self, filename):
+        try:
+            with open(filename, 'r') as fh:
+                return fh.read()
+        except IOError:
+            return None
+
+    def preview(self):
+        """
+        Compute all queued changes without writing anything. Returns a dict
+        of filename -> unified diff (or the exception preventing the change)
+        """
+        results = OrderedDict()
+        with self.index.lock:
+            for filename, changes in self.changes.iteritems():
+                try:
+                    content = self._apply(filename, changes)
+                except Exception, err:
+                    results[filename] = err
+                else:
+                    original = self._read(filename) or ''
+                    results[filename] = ''.join(difflib.unified_diff(
+                        original.splitlines(True), content.splitlines(True), filename, filename
+                    ))
+
+        self.changes = OrderedDict()
+        return results
+
+    def commit(self, atomic=False):
+        """
+        Write all queued changes. Every file is handled on its own, so an
+        error only affects the changes of that file. Returns a dict of
+        filename -> exception (None on success)
+
+        With atomic set, the new content of every file is computed before
+        anything is written. If any file fails, nothing is written (or the
+        files written so far are restored) and every file reports the error.
+        The original contents are kept until the next commit, so a
+        successful atomic commit can still be undone with rollback().
+        """
+        results = OrderedDict()
+        self.backups = OrderedDict()
+        self.written = {}
+        with self.index.lock:
+            if not atomic:
+                for filename, changes in self.changes.iteritems():
+                    try:
+                        self._write(filename, self._apply(filename, changes))
+                    except Exception, err:
+                        results[filename] = err
+                    else:
+                        results[filename] = None
+                    self.index.invalidate(filename)
+            else:
+                try:
+                    contents = OrderedDict([
+                        (filename, self._apply(filename, changes))
+                        for filename, changes in self.changes.iteritems()
+                    ])
+                    for filename, content in contents.iteritems():
+                        self.backups[filename] = self._read(filename)
+                        self._write(filename, content)
+                        self.written[filename] = content
+                except Exception, err:
+                    self.rollback()
+                    results = OrderedDict([(filename, err) for filename in self.changes])
+                else:
+                    results = OrderedDict([(filename, None) for filename in self.changes])
+                    self.index.invalidate(*self.backups.keys())
+
+        self.changes = OrderedDict()
+        return results
+
+    def rollback(self):
+        """
+        Restore all files written by the last atomic commit. Files changed
+        by someone else since are left alone, returns their names
+        """
+        conflicts = []
+        with self.index.lock:
+            for filename, content in reversed(self.backups.items()):
+                if filename in self.written and self._read(filename) != self.written[filename]:
+                    conflicts.append(filename)
+                    continue
+                if content is None:
+                    if os.path.exists(filename):
+                        os.unlink(filename)
+                else:
+                    self._write(filename, content)
+                self.index.invalidate(filename)
+            self.backups = OrderedDict()
+            self.written = {}
+        return conflicts